@@ -0,0 +1,219 @@
+"""
+Package for benchmarking the oscillators, filters and table builders.
+
+Each benchmark is a `Case`: a setup function returning a callable that
+processes some number of samples, which is timed over several runs. The best
+run is taken as the time for the case, since slower runs only measure
+interference from the rest of the system. Each case reports
+
+    seconds     the best time for one run
+    samples/s   samples processed per second
+    realtime    seconds of audio processed per second of wall time, or how many
+                times faster than real time the case runs (above 1.0 keeps up)
+    peak KB     the most memory held at once while setting the case up and
+                running it once, traced by tracemalloc in a separate, untimed
+                pass. Without tracemalloc (Python 2), the growth of the peak
+                resident memory of the process is used instead, which also
+                counts pages of shared libraries first touched by the case.
+    aliasing    for the cases comparing interpolation tiers, the power of what
+                the interpolation adds to the signal relative to the signal, in
+                dB, measured once and untimed (lower is cleaner)
+
+Each case is run in a forked child process where the platform allows, so
+that nothing it caches carries over to the next case, and its peak resident
+memory isn't hidden by the high water mark of the cases before it.
+
+Results are written as JSON, and can be compared against a baseline file of
+earlier results; a case regresses if it takes more than `threshold` longer
+than its baseline. See bench/cases.py for the cases, and run `python -m bench`
+from dsp/ for the command line.
+"""
+
+import json
+import os
+import pickle
+import platform
+import sys
+import timeit
+import traceback
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+class Case(object):
+    """
+    A single benchmark.
+
+    Parameters
+    name : Unique name of the case, e.g. 'render/standard/256'.
+    setup : Function returning the callable to time. Anything it allocates
+            counts towards the peak memory of the case, but not its time.
+    samples : The number of samples processed by each call, or None if the
+              case doesn't process a stream of samples.
+    sample_rate : The sample rate of the samples, for the real time factor.
+    aliasing : Optional function returning the aliasing of the case, in dB.
+    """
+
+    def __init__(self, name, setup, samples=None, sample_rate=None,
+            aliasing=None):
+        self.name = name
+        self.setup = setup
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.aliasing = aliasing
+
+def _peak_rss():
+    """
+    Returns the peak resident memory of this process so far, in KB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes, rather than KB as on Linux.
+        peak //= 1024
+
+    return peak
+
+def _peak_memory(case):
+    """
+    Returns the peak memory, in KB, of setting up the given case and running
+    it once, or None if it can't be measured.
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            case.setup()()
+            return tracemalloc.get_traced_memory()[1] // 1024
+        finally:
+            tracemalloc.stop()
+
+    if resource is not None:
+        start = _peak_rss()
+        case.setup()()
+        return _peak_rss() - start
+
+    return None
+
+def _measure(case, repeat):
+    peak = _peak_memory(case)
+    fn = case.setup()
+
+    times = []
+    for _ in range(repeat):
+        t = timeit.default_timer()
+        fn()
+        times.append(timeit.default_timer() - t)
+
+    seconds = min(times)
+    result = {
+        'name': case.name,
+        'seconds': seconds,
+        'samples': case.samples,
+        'samples_per_sec': None,
+        'realtime': None,
+        'peak_kb': peak,
+        'aliasing_db': None,
+    }
+
+    if case.samples is not None:
+        result['samples_per_sec'] = case.samples / seconds
+    if case.sample_rate is not None:
+        result['realtime'] = case.samples / float(case.sample_rate) / seconds
+    if case.aliasing is not None:
+        result['aliasing_db'] = case.aliasing()
+
+    return result
+
+def _isolated(fn, *args):
+    """
+    Returns the result of `fn(*args)`, called in a forked child process.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        status = 1
+        try:
+            os.close(read)
+            with os.fdopen(write, 'wb') as f:
+                pickle.dump(fn(*args), f, -1)
+            status = 0
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        data = f.read()
+    _, status = os.waitpid(pid, 0)
+
+    if status != 0 or not data:
+        raise Exception('Benchmark process failed.')
+
+    return pickle.loads(data)
+
+def run(case, repeat=5, isolate=True):
+    """
+    Time the given case over `repeat` runs, returning its result as a dict of
+    the fields written to JSON.
+    """
+    if isolate and hasattr(os, 'fork'):
+        return _isolated(_measure, case, repeat)
+
+    return _measure(case, repeat)
+
+def environment():
+    """
+    Returns a description of the interpreter and machine the results come
+    from, stored alongside them.
+    """
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+    }
+
+def write(name, results):
+    """
+    Write a list of results, along with the environment, to a JSON file.
+    """
+    with open(name, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f,
+                indent=2, sort_keys=True)
+
+def read(name):
+    """
+    Returns the list of results in a JSON file written by `write`.
+    """
+    with open(name) as f:
+        return json.load(f)['results']
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compare each result against the baseline result of the same name,
+    returning a list of (name, ratio, regressed) tuples, where the ratio is the
+    new time over the baseline time. A case regresses if its ratio exceeds
+    1 + `threshold`. Cases missing from the baseline are skipped.
+    """
+    previous = dict((r['name'], r) for r in baseline)
+    comparisons = []
+
+    for result in results:
+        base = previous.get(result['name'])
+        if base is None:
+            continue
+
+        ratio = result['seconds'] / base['seconds']
+        comparisons.append((result['name'], ratio, ratio > 1.0 + threshold))
+
+    return comparisons
@@ -0,0 +1,70 @@
+"""
+Command line entry point for the benchmarks; run `python -m bench -h` from
+dsp/ for usage.
+"""
+
+import argparse
+import sys
+
+import bench
+
+from bench.cases import BLOCK_SIZES, cases
+
+def _format(value, spec):
+    return '-' if value is None else spec % value
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the benchmarks.')
+    parser.add_argument('-o', '--output', default='bench.json',
+            help='file to write the results to, as JSON')
+    parser.add_argument('-b', '--baseline', default=None,
+            help='results file to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+            help='slowdown over the baseline counted as a regression')
+    parser.add_argument('-k', '--filter', default='',
+            help='only run the cases whose names contain this string')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+            help='number of runs per case, of which the best is kept')
+    parser.add_argument('-d', '--duration', type=float, default=1.0,
+            help='seconds of audio processed per run')
+    parser.add_argument('-s', '--block-sizes', type=int, nargs='+',
+            default=BLOCK_SIZES, help='block sizes to stream with')
+    parser.add_argument('--no-isolate', action='store_true',
+            help='run every case in this process rather than a fork')
+    args = parser.parse_args()
+
+    print('%-32s %10s %12s %10s %10s %10s' % ('case', 'seconds', 'samples/s',
+        'realtime', 'peak KB', 'aliasing'))
+
+    results = []
+    for case in cases(args.duration, args.block_sizes):
+        if args.filter not in case.name:
+            continue
+
+        result = bench.run(case, args.repeat, not args.no_isolate)
+        results.append(result)
+
+        print('%-32s %10.5f %12s %10s %10s %10s' % (case.name,
+            result['seconds'], _format(result['samples_per_sec'], '%.0f'),
+            _format(result['realtime'], '%.1fx'),
+            _format(result['peak_kb'], '%d'),
+            _format(result['aliasing_db'], '%.1fdB')))
+
+    bench.write(args.output, results)
+
+    if args.baseline is None:
+        sys.exit(0)
+
+    comparisons = bench.compare(results, bench.read(args.baseline),
+            args.threshold)
+    regressions = [c for c in comparisons if c[2]]
+
+    print('')
+    print('Against %s:' % args.baseline)
+    for name, ratio, regressed in comparisons:
+        print('%-32s %9.2fx%s' % (name, ratio,
+            '  REGRESSION' if regressed else ''))
+
+    print('%d of %d cases regressed by more than %d%%.' % (len(regressions),
+        len(comparisons), round(args.threshold * 100)))
+    sys.exit(1 if regressions else 0)
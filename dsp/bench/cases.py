@@ -0,0 +1,196 @@
+"""
+Module defining the benchmark cases.
+
+    build/<wave type>/<range>        building the tables for every note in a
+                                     third of the MIDI range, from scratch
+    genmap                           writing a default mipmap file end to end
+    render/<oscillator>/<block>      rendering a stream in blocks of the given
+                                     size
+    filter/<filter>/<block>          filtering a stream in blocks of the given
+                                     size
+    interp/<tier>/<table size>       rendering a stream from a table of the
+                                     given size with each interpolation tier,
+                                     along with the aliasing of the tier at
+                                     that size (see interpolation.aliasing)
+    interp/realtime/<tier>           rendering a stream from a real time
+                                     resampling oscillator with each tier
+
+Every streaming case processes `duration` seconds of audio per run.
+"""
+
+import numpy as np
+import os
+import tempfile
+
+from bench import Case
+from filters import allpass, biquad, oversample, phaser
+from wavetable import interpolation, mipmap, wavetable
+from wavetable.oscillators import StandardOscillator, ResamplingOscillator, \
+        RealTimeResamplingOscillator, UnisonOscillator
+from wavetable.utils import note_to_freq
+from wavetable.wavetable import WaveType
+
+BLOCK_SIZES = (64, 256, 1024, 4096)
+
+WAVE_TYPES = (
+    ('sine', WaveType.SINE),
+    ('triangle', WaveType.TRIANGLE),
+    ('sawtooth', WaveType.SAWTOOTH),
+    ('square', WaveType.SQUARE),
+)
+
+NOTE_RANGES = (
+    ('low', range(0, 43)),
+    ('mid', range(43, 86)),
+    ('high', range(86, 128)),
+)
+
+# A seven voice supersaw, as in main.py.
+DETUNES = np.linspace(-12.0, 12.0, 7)
+LEVELS = np.full(7, 1.0 / 7)
+
+OSCILLATORS = (
+    ('standard', lambda: StandardOscillator(WaveType.SAWTOOTH, 43.65, 3.0,
+        1.0)),
+    ('resampling', lambda: ResamplingOscillator(WaveType.SAWTOOTH, 43.65,
+        3.0, 1.0)),
+    ('realtime', lambda: RealTimeResamplingOscillator(WaveType.SAWTOOTH,
+        43.65, 3.0, 1.0)),
+    ('unison', lambda: UnisonOscillator(WaveType.SAWTOOTH, 43.65, DETUNES,
+        LEVELS)),
+    ('unison-resampling', lambda: UnisonOscillator(WaveType.SAWTOOTH, 43.65,
+        DETUNES, LEVELS, resampling=True)),
+)
+
+FILTERS = (
+    ('biquad', lambda: biquad.AllpassFilter(wavetable.SAMPLE_RATE, 1000.0,
+        0.7)),
+    ('allpass', lambda: allpass.AllpassFilter(0.5, 1.0, 0.5)),
+    ('allpass-2x', lambda: oversample.Oversampler(allpass.AllpassFilter(0.5,
+        1.0, 0.5, 2 * wavetable.SAMPLE_RATE), 2)),
+    ('allpass-4x', lambda: oversample.Oversampler(allpass.AllpassFilter(0.5,
+        1.0, 0.5, 4 * wavetable.SAMPLE_RATE), 4)),
+    ('phaser', lambda: phaser.Phaser(8, 0.5, sections='biquad')),
+    ('phaser-feedback', lambda: phaser.Phaser(8, 0.5, feedback=0.7,
+        sections='biquad')),
+)
+
+# The table sizes and block size of the interpolation cases. Each tier reads the
+# same partial from each size, so that a tier reading a small table can be
+# compared against a cheaper tier reading a larger one.
+TABLE_SIZES = (256, 1024, 4096)
+INTERPOLATION_BLOCK_SIZE = 256
+
+def _build(wavetype, notes):
+    def setup():
+        def fn():
+            wavetable.cache.clear()
+            for note in notes:
+                wavetable.build(wavetype, note_to_freq(note))
+
+        return fn
+
+    return setup
+
+def _genmap():
+    name = os.path.join(tempfile.gettempdir(), 'bench_mipmap.pcm')
+
+    def fn():
+        wavetable.cache.clear()
+        mipmap.write(name)
+        os.remove(name)
+
+    return fn
+
+def _blocks(process, size, block_size):
+    """
+    Returns a function calling `process(start, stop)` over consecutive blocks
+    spanning `size` samples.
+    """
+    bounds = [(i, min(i + block_size, size))
+            for i in range(0, size, block_size)]
+
+    def fn():
+        for start, stop in bounds:
+            process(start, stop)
+
+    return fn
+
+def _render(make, size, block_size):
+    def setup():
+        osc = make()
+        buf = np.zeros(size, dtype=wavetable.DTYPE)
+
+        # Render a block first, so that scratch space and tables are ready.
+        osc.render(buf[:block_size])
+
+        return _blocks(lambda start, stop: osc.render(buf[start:stop]), size,
+                block_size)
+
+    return setup
+
+def _filter(make, size, block_size):
+    def setup():
+        filt = make()
+        x = np.zeros(size, dtype=wavetable.DTYPE)
+        StandardOscillator(WaveType.SAWTOOTH, 43.65, 0.0, 1.0).render(x)
+        y = np.zeros_like(x)
+
+        filt.process_block(x[:block_size], y[:block_size])
+
+        return _blocks(lambda start, stop: filt.process_block(x[start:stop],
+            y[start:stop]), size, block_size)
+
+    return setup
+
+def _interpolation(tier, table_size, size):
+    make = lambda: StandardOscillator(WaveType.SAWTOOTH, 43.65, 3.0, 1.0,
+            table_size=table_size, interpolation=tier)
+
+    return _render(make, size, INTERPOLATION_BLOCK_SIZE)
+
+def _aliasing(tier, table_size):
+    return lambda: interpolation.aliasing(tier, table_size)
+
+def cases(duration=1.0, block_sizes=BLOCK_SIZES):
+    """
+    Returns the list of benchmark cases.
+
+    Parameters
+    duration : Seconds of audio processed by each run of a streaming case.
+    block_sizes : The block sizes to stream with.
+    """
+    fs = wavetable.SAMPLE_RATE
+    size = int(duration * fs)
+    result = []
+
+    for name, wavetype in WAVE_TYPES:
+        for range_name, notes in NOTE_RANGES:
+            result.append(Case('build/%s/%s' % (name, range_name),
+                _build(wavetype, notes)))
+
+    result.append(Case('genmap', _genmap))
+
+    for name, make in OSCILLATORS:
+        for block_size in block_sizes:
+            result.append(Case('render/%s/%d' % (name, block_size),
+                _render(make, size, block_size), size, fs))
+
+    for name, make in FILTERS:
+        for block_size in block_sizes:
+            result.append(Case('filter/%s/%d' % (name, block_size),
+                _filter(make, size, block_size), size, fs))
+
+    for name, tier in interpolation.TIERS:
+        for table_size in TABLE_SIZES:
+            result.append(Case('interp/%s/%d' % (name, table_size),
+                _interpolation(tier, table_size, size), size, fs,
+                _aliasing(tier, table_size)))
+
+    for name, tier in interpolation.TIERS:
+        make = lambda tier=tier: RealTimeResamplingOscillator(
+                WaveType.SAWTOOTH, 43.65, 3.0, 1.0, interpolation=tier)
+        result.append(Case('interp/realtime/%s' % name,
+            _render(make, size, INTERPOLATION_BLOCK_SIZE), size, fs))
+
+    return result
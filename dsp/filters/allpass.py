@@ -5,9 +5,73 @@ Module defining a first order allpass filter with modulating coefficients.
 import matplotlib.pyplot as plt
 import numpy as np
 
+from array import array
+from itertools import islice
 from scipy import signal
 from wavetable.oscillators import StandardOscillator, RealTimeResamplingOscillator
-from wavetable.wavetable import WaveType
+from wavetable.utils import Scratch
+from wavetable.wavetable import DTYPE, WaveType
+
+def _process(coeffs, x, x1, y1, y):
+    """
+    The time-varying first-order allpass recursion,
+
+        y[n] = c[n] * x[n] + x[n - 1] - c[n] * y[n - 1]
+             = c[n] * (x[n] - y[n - 1]) + x[n - 1]
+
+    Each output depends on the last, so this can't be vectorized; instead the
+    loop runs over plain Python floats, which is far cheaper per sample than
+    indexing into numpy arrays.
+
+    Parameters
+    coeffs : Iterable of coefficient values c[n], one per sample.
+    x : Iterable of input samples, at least as long as coeffs.
+    x1 : The input sample preceding x[0].
+    y1 : The output sample preceding the first output.
+    y : Python array to write the output samples to.
+    """
+    i = 0
+    for c, xn in zip(coeffs, x):
+        y1 = c * (xn - y1) + x1
+        x1 = xn
+        y[i] = y1
+        i += 1
+
+def _scan(a, u, scratch):
+    """
+    Solves the first-order recurrence
+
+        y[n] = a[n] * y[n - 1] + u[n]
+
+    along the last axis, with y[-1] = 0, writing y over `u` and overwriting
+    `a`. `a` may have a single row, shared by every row of `u`.
+
+    Each step of the recurrence is an affine map, and composing two affine maps
+    gives another, so rather than stepping through the samples one at a time
+    the maps are composed in log2(n) vectorized passes over every sample and
+    channel at once (a Hillis-Steele scan). The result differs from stepping
+    through the recursion only by rounding.
+
+    Parameters
+    a : Array of the multiplier values a[n].
+    u : Array of the input values u[n].
+    scratch : Scratch arrays to compute with.
+    """
+    n = u.shape[-1]
+    tu = scratch.get('scan_u', u.shape, u.dtype)
+    ta = scratch.get('scan_a', a.shape, a.dtype)
+
+    # After the pass with shift s, each value holds the composition of the
+    # maps for the 2s samples up to and including it.
+    s = 1
+    while s < n:
+        np.multiply(a[:, s:], u[:, :n - s], out=tu[:, :n - s])
+        u[:, s:] += tu[:, :n - s]
+
+        np.multiply(a[:, s:], a[:, :n - s], out=ta[:, :n - s])
+        a[:, s:] = ta[:, :n - s]
+
+        s *= 2
 
 class AllpassFilter:
     """
@@ -21,65 +85,182 @@ class AllpassFilter:
     amplitude   : [0.0, 1.0] : The amplitude of the modulating signal.
                     Effectively the "amount" of modulation.
     rate        : [0, 96000] : The rate (Hz) of the modulating signal.
+    fs          : The sampling frequency; 44.1kHz by default.
+    dtype       : The dtype of the output and state. The coefficient trajectory
+                    is computed in double precision, from the sample clock.
+
+    Blocks may be 1D, or (channels x samples) arrays, in which case each
+    channel keeps its own state. The offset, amplitude and rate may also be
+    arrays with one value per channel, for modulating each channel differently.
     """
 
-    def __init__(self, offset, amplitude, rate):
+    def __init__(self, offset, amplitude, rate, fs=44100., dtype=DTYPE):
         # The maximum and minimum values allowed in the modulating signal, so as
         # to keep the DC delay within a reasonable range, and to avoid the pole
         # zero cancellation at delta = 0.0.
         self._mmax = 0.82
         self._mmin = -0.05
 
+        # Per-channel parameters are stored as columns, so that they broadcast
+        # against a row of sample times.
+        self.channels = None
+        if np.ndim(offset) or np.ndim(amplitude) or np.ndim(rate):
+            offset, amplitude, rate = [p[:, np.newaxis] for p in
+                    np.broadcast_arrays(np.atleast_1d(offset),
+                        np.atleast_1d(amplitude), np.atleast_1d(rate))]
+            self.channels = offset.shape[0]
+
         self._range = self._mmax - self._mmin
         self._offset = offset * self._range
-        self._amp = min(amplitude, self._mmax - self._offset)
+        if self.channels is None:
+            self._amp = min(amplitude, self._mmax - self._offset)
+        else:
+            self._amp = np.minimum(amplitude, self._mmax - self._offset)
         self._rate = rate
+        self.fs = float(fs)
+        self.dtype = np.dtype(dtype)
 
         # Initial coefficient values
         self.a0 = 1.0
         self.b1 = 1.0
         self.b0 = self.a1 = self._mmin + self._offset
 
-        # Zero pad the initial input and output buffers. The filter will be in
-        # its transient state for 1 sample before reaching steady state.
+        # The previous input and output samples, carried across blocks. For
+        # (channels x samples) blocks, these become arrays of one value per
+        # channel.
         self._x = 0.0
         self._y = 0.0
 
-    def update(self, t):
-        # Note: this implementation works only for large continuous blocks; if
-        # instead it operated on discrete blocks in a continuous stream, the `t`
-        # input would yield discontinuities.
-        return self._mmin + self._offset + \
-                self._amp * np.sin(2.0 * np.pi * self._rate * t / 44100.)
+        # The absolute sample clock driving the modulating signal. It runs
+        # continuously across blocks, so streaming a signal through the filter
+        # block by block yields the same modulation as one large block.
+        self._clock = 0
+
+        # Scratch space for the multichannel path, and the Python arrays the
+        # recursion reads from and writes to, which numpy can view without a
+        # copy. They only grow, so the steady state allocates nothing.
+        self._scratch = Scratch()
+        self._coeffs = array('d')
+        self._in = array(self.dtype.char)
+        self._out = array(self.dtype.char)
+
+    def update(self, t, out=None):
+        """
+        Returns the modulated coefficient value at the absolute sample time
+        `t`. Given an array of sample times, the values may instead be written
+        to `out`, which may be `t` itself.
+        """
+        if out is None:
+            return self._mmin + self._offset + \
+                    self._amp * np.sin(2.0 * np.pi * self._rate * t / self.fs)
+
+        # The same computation as above, in place.
+        np.multiply(t, 2.0 * np.pi * self._rate, out=out)
+        out /= self.fs
+        np.sin(out, out=out)
+        out *= self._amp
+        out += self._mmin + self._offset
+
+        return out
 
     def process_block(self, input_buffer, output_buffer):
-        _len = input_buffer.size
-        _x = np.insert(input_buffer, 0, self._x)
-        _y = np.insert(output_buffer, 0, self._y)
-
-        for i in range(2, _len):
-            sample = (self.b0 / self.a0) * _x[i]     \
-                   + (self.b1 / self.a0) * _x[i - 1] \
-                   - (self.a1 / self.a0) * _y[i - 1] \
-
-            _y[i] = sample
-            self.b0 = self.a1 = self.update(i)
-
-        np.copyto(output_buffer, _y[1:])
-        self._x = input_buffer[-1]
-        self._y = output_buffer[-1]
+        if input_buffer.ndim == 2:
+            return self._process_channels(input_buffer, output_buffer)
+        if self.channels is not None:
+            raise Exception('Expected one channel per set of parameters.')
+
+        n = input_buffer.size
+        if n == 0:
+            return
+
+        if len(self._out) < n:
+            self._coeffs = array('d', [0.0]) * n
+            self._in = array(self.dtype.char, [0.0]) * n
+            self._out = array(self.dtype.char, [0.0]) * n
+
+        # Precompute the coefficient trajectory for the whole block, then run
+        # the recursion over it, reading both through the Python arrays
+        # rather than lists made afresh for every block.
+        coeffs = np.frombuffer(self._coeffs, dtype=np.float64, count=n)
+        np.add(self._scratch.ramp(n), self._clock, out=coeffs)
+        self.update(coeffs, out=coeffs)
+        np.copyto(np.frombuffer(self._in, dtype=self.dtype, count=n),
+                input_buffer)
+
+        _process(islice(self._coeffs, n), self._in, self._x, self._y,
+                self._out)
+        np.copyto(output_buffer, np.frombuffer(self._out, dtype=self.dtype,
+                count=n))
+
+        self._clock += n
+        self._x = float(input_buffer[-1])
+        self._y = float(output_buffer[-1])
+        self.b0 = self.a1 = self.update(self._clock)
+
+    def _process_channels(self, input_buffer, output_buffer):
+        channels, n = input_buffer.shape
+        scratch = self._scratch
+
+        if self.channels not in (None, channels):
+            raise Exception('Expected one channel per set of parameters.')
+
+        if np.shape(self._x) != (channels,):
+            if self._clock != 0:
+                raise Exception('Filter was started with a different number '
+                        'of channels.')
+            self._x = np.zeros(channels, dtype=self.dtype)
+            self._y = np.zeros(channels, dtype=self.dtype)
+
+        if n == 0:
+            return
+
+        # The coefficient trajectory, with a single row unless the channels
+        # are modulated differently.
+        rows = self.channels or 1
+        coeffs = scratch.get('coeffs', (rows, n))
+        np.add(scratch.ramp(n), self._clock, out=coeffs)
+        self.update(coeffs, out=coeffs)
+
+        # Cast down to the dtype of the blocks before mixing the two, which
+        # would otherwise have numpy buffer the cast.
+        if coeffs.dtype != self.dtype:
+            cast = scratch.get('cast', (rows, n), self.dtype)
+            np.copyto(cast, coeffs)
+            coeffs = cast
+
+        # Written as y[n] = -c[n] * y[n - 1] + (c[n] * x[n] + x[n - 1]), the
+        # recursion is a first-order recurrence for _scan to solve across
+        # every channel at once, with the previous output folded into u[0].
+        a = scratch.get('a', (rows, n), self.dtype)
+        np.negative(coeffs, out=a)
+
+        u = scratch.get('u', (channels, n), self.dtype)
+        np.multiply(coeffs, input_buffer, out=u)
+        u[:, 1:] += input_buffer[:, :-1]
+        u[:, 0] += self._x
+        u[:, 0] += a[:, 0] * self._y
+
+        _scan(a, u, scratch)
+        np.copyto(output_buffer, u)
+
+        self._clock += n
+        np.copyto(self._x, input_buffer[:, -1])
+        np.copyto(self._y, output_buffer[:, -1])
+        self.b0 = self.a1 = self.update(self._clock)
 
     def plot(self, ax1, ax2, color='c', alpha=1.0):
-        w, h = signal.freqz([self.b0, self.b1], [self.a0, self.a1])
+        # Plot the response of each channel's current coefficients.
+        for c in np.ravel(self.a1):
+            w, h = signal.freqz([c, self.b1], [self.a0, c])
 
-        # Scale x-axis to Hz.
-        x = w * 44100 / (2 * np.pi)
+            # Scale x-axis to Hz.
+            x = w * self.fs / (2 * np.pi)
 
-        # Plot amplitude response on the dB scale.
-        ax1.plot(x,  20 * np.log10(abs(h)), color=color, alpha=alpha)
+            # Plot amplitude response on the dB scale.
+            ax1.plot(x,  20 * np.log10(abs(h)), color=color, alpha=alpha)
 
-        # Plot phase response in radians.
-        ax2.plot(x, np.unwrap(np.angle(h)), color=color, alpha=alpha)
+            # Plot phase response in radians.
+            ax2.plot(x, np.unwrap(np.angle(h)), color=color, alpha=alpha)
 
         ax1.set_title('Amplitude Response (dB)')
         ax2.set_title('Phase Response (radians)')
@@ -132,6 +313,49 @@ if __name__ == '__main__':
     apf = AllpassFilter(0.5, 1.0, 64000)
     apf.process_block(ss, ap)
 
+    # The modulation runs on an absolute sample clock, so streaming the same
+    # signal in small blocks, empty ones included, matches the single large
+    # block.
+    apb = np.zeros(size, dtype='d')
+    apf = AllpassFilter(0.5, 1.0, 64000)
+    for i in range(0, size, 128):
+        apf.process_block(ss[i:i + 128], apb[i:i + 128])
+        apf.process_block(ss[i:i], apb[i:i])
+
+    assert np.array_equal(ap, apb)
+
+    # A (channels x samples) block runs the recursion for every channel at
+    # once, and matches filtering each channel on its own up to rounding.
+    # Empty (channels x 0) blocks leave the filter untouched.
+    stems = np.vstack([ss, rs, ss[::-1]])
+    rates = np.array([64000, 32000, 500])
+
+    for rate in (64000, rates):
+        mc = np.zeros_like(stems)
+        apf = AllpassFilter(0.5, 1.0, rate)
+        for i in range(0, size, 128):
+            apf.process_block(stems[:, i:i + 128], mc[:, i:i + 128])
+            apf.process_block(stems[:, i:i], mc[:, i:i])
+
+        for stem, out, r in zip(stems, mc, np.broadcast_to(rate, 3)):
+            y = np.zeros(size, dtype='d')
+            AllpassFilter(0.5, 1.0, r).process_block(stem, y)
+            assert np.allclose(out, y)
+
+    # In single precision, the output stays within a few float32 steps of the
+    # double precision output.
+    for rate, sig in ((64000, ss), (rates, stems)):
+        s32 = sig.astype(np.float32)
+        y32 = np.zeros_like(s32)
+        apf = AllpassFilter(0.5, 1.0, rate, dtype=np.float32)
+        for i in range(0, size, 128):
+            apf.process_block(s32[..., i:i + 128], y32[..., i:i + 128])
+
+        y = np.zeros_like(sig)
+        AllpassFilter(0.5, 1.0, rate).process_block(sig, y)
+
+        assert np.abs(y - y32).max() < 1e-6
+
     plt.figure()
     plt.subplot(211)
     plt.plot(x, rs - ss)
@@ -8,62 +8,118 @@ on MusicDSP.org: http://www.musicdsp.org/files/Audio-EQ-Cookbook.txt
 
 import matplotlib.pyplot as plt
 import numpy as np
+import parallel
 
 from scipy import signal
 from wavetable.oscillators import StandardOscillator, RealTimeResamplingOscillator
-from wavetable.wavetable import WaveType
+from wavetable.wavetable import DTYPE, WaveType
 
 class BiquadFilter(object):
     """
     Biquad filter base class.
 
     Handles most of the filter internals, but leaves computing the coefficients
-    to the subclass constructors.
+    to the subclass constructors. The sampling frequency, `fs`, is used only to
+    scale the frequency axis when plotting. The coefficients and state are kept
+    in the given `dtype`, which blocks should share, so that `lfilter` runs in
+    that precision.
+
+    Blocks may be 1D, or (channels x samples) arrays, in which case each
+    channel keeps its own state. The coefficients may also be arrays with one
+    value per channel, for filtering each channel differently.
     """
 
-    def __init__(self, b0, b1, b2, a0, a1, a2):
+    def __init__(self, b0, b1, b2, a0, a1, a2, fs=44100., dtype=DTYPE):
         self.b0 = b0
         self.b1 = b1
         self.b2 = b2
         self.a0 = a0
         self.a1 = a1
         self.a2 = a2
-
-        # Zero pad the initial input and output buffers. The filter will be in
-        # its transient state for 2 samples before reaching steady state.
-        self._x = np.zeros(2)
-        self._y = np.zeros(2)
+        self.fs = float(fs)
+        self.dtype = np.dtype(dtype)
+
+        # Normalize the coefficients by a0 once, up front, rather than on every
+        # sample. Per-channel coefficients are stored one row per channel.
+        self._b = (np.array([b0, b1, b2], dtype='d') / a0).T.astype(dtype)
+        self._a = (np.array([a0, a1, a2], dtype='d') / a0).T.astype(dtype)
+
+        # The internal state of the filter (the delay line of the transposed
+        # direct form II structure used by `signal.lfilter`), carried across
+        # blocks so that processing a signal block by block is identical to
+        # processing it in one pass. The filter starts at rest, and the state
+        # takes the shape of the first block, one pair of values per channel.
+        self._zi = None
+
+    def _state(self, input_buffer):
+        """
+        Returns the shape of the filter state for the given block, starting
+        the filter at rest on its first block.
+        """
+        shape = input_buffer.shape[:-1] + (2,)
+
+        if self._zi is None:
+            self._zi = np.zeros(shape, dtype=self.dtype)
+        elif self._zi.shape != shape:
+            raise Exception('Filter was started with a different number of '
+                    'channels.')
+
+        return shape
 
     def process_block(self, input_buffer, output_buffer):
-        _len = input_buffer.size
-        _x = np.concatenate((self._x, input_buffer))
-        _y = np.concatenate((self._y, output_buffer))
-
-        for i in range(2, _len):
-            sample = (self.b0 / self.a0) * _x[i]     \
-                   + (self.b1 / self.a0) * _x[i - 1] \
-                   + (self.b2 / self.a0) * _x[i - 2] \
-                   - (self.a1 / self.a0) * _y[i - 1] \
-                   - (self.a2 / self.a0) * _y[i - 2]
-
-            _y[i] = sample
-
-        np.copyto(output_buffer, _y[2:])
-        self._x = input_buffer[-2:]
-        self._y = output_buffer[-2:]
+        shape = self._state(input_buffer)
+        if input_buffer.shape[-1] == 0:
+            return
+
+        if self._b.ndim == 1:
+            # lfilter runs the recursion for every channel in one call.
+            y, self._zi = signal.lfilter(self._b, self._a, input_buffer,
+                    axis=-1, zi=self._zi)
+            np.copyto(output_buffer, y)
+            return
+
+        if shape != (self._b.shape[0], 2):
+            raise Exception('Expected one channel per set of coefficients.')
+
+        # lfilter takes a single set of coefficients, so each channel is
+        # filtered with its own call.
+        for i in range(shape[0]):
+            y, self._zi[i] = signal.lfilter(self._b[i], self._a[i],
+                    input_buffer[i], zi=self._zi[i])
+            np.copyto(output_buffer[i], y)
+
+    def process_offline(self, input_buffer, output_buffer, processes=None,
+            chunk_size=None):
+        """
+        Filter a long block in the same way as `process_block`, but split into
+        chunks filtered across a pool of processes; see `parallel.lfilter`.
+        The output matches `process_block` up to rounding, and the filter
+        state carries on to the next block as usual.
+        """
+        self._state(input_buffer)
+
+        if self._b.ndim != 1:
+            raise Exception('Per-channel coefficients are not supported '
+                    'offline.')
+
+        y, zf = parallel.lfilter(self._b, self._a, input_buffer, self._zi,
+                processes, chunk_size)
+        np.copyto(output_buffer, y)
+        np.copyto(self._zi, zf)
 
     def plot(self, ax1, ax2, color='c', alpha=1.0):
-        w, h = signal.freqz([self.b0, self.b1, self.b2],
-                [self.a0, self.a1, self.a2])
+        # Plot the response of each channel's coefficients.
+        for b, a in zip(np.atleast_2d(self._b), np.atleast_2d(self._a)):
+            w, h = signal.freqz(b, a)
 
-        # Scale x-axis to Hz.
-        x = w * 44100 / (2 * np.pi)
+            # Scale x-axis to Hz.
+            x = w * self.fs / (2 * np.pi)
 
-        # Plot amplitude response on the dB scale.
-        ax1.plot(x,  20 * np.log10(abs(h)), color=color, alpha=alpha)
+            # Plot amplitude response on the dB scale.
+            ax1.plot(x,  20 * np.log10(abs(h)), color=color, alpha=alpha)
 
-        # Plot phase response in radians.
-        ax2.plot(x, np.unwrap(np.angle(h)), color=color, alpha=alpha)
+            # Plot phase response in radians.
+            ax2.plot(x, np.unwrap(np.angle(h)), color=color, alpha=alpha)
 
         ax1.set_title('Amplitude Response (dB)')
         ax2.set_title('Phase Response (radians)')
@@ -87,6 +143,23 @@ class BiquadFilter(object):
         ax2.grid()
 
 
+def allpass(fs, f0, Q):
+    """
+    Returns the coefficients (b0, b1, b2, a0, a1, a2) of the allpass filter
+    described below, for scalar or array arguments.
+    """
+    w0 = 2 * np.pi * f0 / fs
+    alpha = np.sin(w0) / (2 * Q)
+
+    b0 = 1. - alpha
+    b1 = -2. * np.cos(w0)
+    b2 = 1. + alpha
+    a0 = 1. + alpha
+    a1 = -2. * np.cos(w0)
+    a2 = 1. - alpha
+
+    return b0, b1, b2, a0, a1, a2
+
 class AllpassFilter(BiquadFilter):
     """
     Allpass filter implementation.
@@ -101,18 +174,182 @@ class AllpassFilter(BiquadFilter):
         greater than one creating a sharp cliff at f0.
     """
 
-    def __init__(self, fs, f0, Q):
-        w0 = 2 * np.pi * f0 / fs
-        alpha = np.sin(w0) / (2 * Q)
+    def __init__(self, fs, f0, Q, dtype=DTYPE):
+        super(AllpassFilter, self).__init__(*allpass(fs, f0, Q), fs=fs,
+                dtype=dtype)
 
-        b0 = 1. - alpha
-        b1 = -2. * np.cos(w0)
-        b2 = 1. + alpha
-        a0 = 1. + alpha
-        a1 = -2. * np.cos(w0)
-        a2 = 1. - alpha
 
-        super(AllpassFilter, self).__init__(b0, b1, b2, a0, a1, a2)
+class CoefficientTable(object):
+    """
+    Lookup table of normalized biquad coefficients over a grid of
+    log-spaced center frequencies and Q values, so that a filter can be swept
+    without evaluating its design (and its trig) per update.
+
+    Coefficients between grid points are interpolated bilinearly in
+    log-frequency and log-Q. Since the stable region of (a1, a2) is convex,
+    interpolating between stable designs always gives a stable filter.
+
+    For the `allpass` design, the default 512 x 32 grid is within 6e-4 per
+    coefficient of the design for center frequencies from 30Hz to 18kHz and Q
+    values from 0.2 to 8. The error grows toward the edges of the table, to
+    about 1.5e-3 near Nyquist at the lowest Q values.
+
+    Parameters
+    design : Function of (fs, f0, Q), such as `allpass`, returning the
+             coefficients (b0, b1, b2, a0, a1, a2) for arrays of f0 and Q.
+    fs : Sampling frequency.
+    f_range : The lowest and highest center frequencies in the table.
+    q_range : The lowest and highest Q values in the table.
+    f_steps : The number of center frequencies in the table.
+    q_steps : The number of Q values in the table.
+    """
+
+    def __init__(self, design, fs, f_range=(20., 20000.), q_range=(0.1, 10.),
+            f_steps=512, q_steps=32):
+        self.fs = float(fs)
+
+        self._lf = np.log2(f_range)
+        self._lq = np.log2(q_range)
+        self._fscale = (f_steps - 1) / (self._lf[1] - self._lf[0])
+        self._qscale = (q_steps - 1) / (self._lq[1] - self._lq[0])
+
+        f0 = np.logspace(self._lf[0], self._lf[1], f_steps, base=2.0)
+        Q = np.logspace(self._lq[0], self._lq[1], q_steps, base=2.0)
+        b0, b1, b2, a0, a1, a2 = design(self.fs, f0[:, np.newaxis], Q)
+
+        # Each entry holds the coefficients (b0, b1, b2, 1, a1, a2), normalized
+        # by a0, with f0 along the first axis and Q along the second.
+        self._table = np.empty((f_steps, q_steps, 6))
+        for i, c in enumerate((b0, b1, b2, a0, a1, a2)):
+            self._table[:, :, i] = c / a0
+
+    def lookup(self, f0, Q):
+        """
+        Returns an (n x 6) array of the normalized coefficients
+        (b0, b1, b2, 1, a1, a2) for arrays of n center frequencies and Q
+        values. Values outside the table are clamped to its edges.
+        """
+        f_steps, q_steps, _ = self._table.shape
+
+        u = (np.log2(f0) - self._lf[0]) * self._fscale
+        v = (np.log2(Q) - self._lq[0]) * self._qscale
+        np.clip(u, 0, f_steps - 1, out=u)
+        np.clip(v, 0, q_steps - 1, out=v)
+
+        i = np.minimum(u.astype(int), f_steps - 2)
+        j = np.minimum(v.astype(int), q_steps - 2)
+        u = (u - i)[:, np.newaxis]
+        v = (v - j)[:, np.newaxis]
+
+        table = self._table
+        return (1 - u) * ((1 - v) * table[i, j] + v * table[i, j + 1]) + \
+                u * ((1 - v) * table[i + 1, j] + v * table[i + 1, j + 1])
+
+
+class ModulatedBiquad(BiquadFilter):
+    """
+    Biquad filter whose center frequency and Q can be swept block by block.
+
+    Given trajectories for f0 and Q, each block is filtered in sub-blocks of
+    `sub_block` samples, with the coefficients for each sub-block pulled from a
+    CoefficientTable at the trajectories' values at its start, and each
+    sub-block run through `signal.lfilter`. The sub-blocks run on an absolute
+    sample clock, so the coefficients are updated at the same samples however
+    the signal is split into blocks. The filter state carries straight on from
+    one sub-block (and block) to the next, so the coefficients change without
+    resetting the filter.
+
+    The coefficients step from one sub-block to the next, which a fast sweep
+    can make audible as zipper noise; a smaller `sub_block` smooths the sweep,
+    at the cost of more calls to `lfilter` per block.
+
+    Parameters
+    fs : Sampling frequency.
+    f0 : Initial center frequency.
+    Q : Initial quality.
+    table : The CoefficientTable to read from; by default, a table of
+            `allpass` designs shared by every filter at this sampling
+            frequency.
+    sub_block : The number of samples between coefficient updates.
+    dtype : The dtype of the coefficients and state.
+    """
+
+    # Default allpass tables, by sampling frequency.
+    _tables = {}
+
+    def __init__(self, fs, f0, Q, table=None, sub_block=32, dtype=DTYPE):
+        if table is None:
+            table = ModulatedBiquad._tables.get(float(fs))
+            if table is None:
+                table = CoefficientTable(allpass, fs)
+                ModulatedBiquad._tables[float(fs)] = table
+
+        self.f0 = f0
+        self.Q = Q
+        self.table = table
+        self.sub_block = sub_block
+
+        c = table.lookup(np.array([f0], dtype='d'), np.array([Q], dtype='d'))
+        super(ModulatedBiquad, self).__init__(*c[0], fs=fs, dtype=dtype)
+
+        # The absolute sample clock the sub-blocks run on.
+        self._clock = 0
+
+    def process_block(self, input_buffer, output_buffer, f0=None, Q=None):
+        """
+        Filter the next block, optionally sweeping the center frequency and Q
+        along the given per-sample trajectories.
+        """
+        n = input_buffer.shape[-1]
+
+        if f0 is None and Q is None:
+            super(ModulatedBiquad, self).process_block(input_buffer,
+                    output_buffer)
+            self._clock += n
+            return
+
+        self._state(input_buffer)
+        if n == 0:
+            return
+
+        # Where each sub-block starting within this block begins. Any samples
+        # before the first belong to a sub-block begun in an earlier block,
+        # and carry on with its coefficients.
+        fresh = np.arange(-self._clock % self.sub_block, n, self.sub_block)
+
+        f0 = np.broadcast_to(self.f0 if f0 is None else f0, (n,))[fresh]
+        Q = np.broadcast_to(self.Q if Q is None else Q, (n,))[fresh]
+        coeffs = self.table.lookup(np.array(f0, dtype='d'),
+                np.array(Q, dtype='d')).astype(self.dtype, copy=False)
+
+        start = 0
+        b, a = self._b, self._a
+        for k in range(fresh.size + 1):
+            end = fresh[k] if k < fresh.size else n
+            if end > start:
+                y, self._zi = signal.lfilter(b, a,
+                        input_buffer[..., start:end], axis=-1, zi=self._zi)
+                np.copyto(output_buffer[..., start:end], y)
+            if k < fresh.size:
+                b, a = coeffs[k, :3], coeffs[k, 3:]
+            start = end
+
+        self._clock += n
+
+        # Leave the filter where the trajectories were last read, for the next
+        # sub-block, the next static block, and for plotting.
+        if fresh.size:
+            self.f0 = f0[-1]
+            self.Q = Q[-1]
+            self.b0, self.b1, self.b2, self.a0, self.a1, self.a2 = coeffs[-1]
+            self._b = coeffs[-1, :3]
+            self._a = coeffs[-1, 3:]
+
+    def process_offline(self, input_buffer, output_buffer, processes=None,
+            chunk_size=None):
+        super(ModulatedBiquad, self).process_offline(input_buffer,
+                output_buffer, processes, chunk_size)
+        self._clock += input_buffer.shape[-1]
 
 
 if __name__ == '__main__':
@@ -153,6 +390,53 @@ if __name__ == '__main__':
     apf = AllpassFilter(44100, 18000, 0.1)
     apf.process_block(ss, ap)
 
+    # The filter state carries across calls, so processing the same signal in
+    # small blocks, empty ones included, is identical to processing it in one
+    # pass.
+    apb = np.zeros(size, dtype='d')
+    apf = AllpassFilter(44100, 18000, 0.1)
+    for i in range(0, size, 128):
+        apf.process_block(ss[i:i + 128], apb[i:i + 128])
+        apf.process_block(ss[i:i], apb[i:i])
+
+    assert np.array_equal(ap, apb)
+
+    # Long blocks can also be filtered in chunks across a pool of processes,
+    # and the filter carries on from there.
+    apo = np.zeros(size, dtype='d')
+    apf = AllpassFilter(44100, 18000, 0.1)
+    apf.process_offline(ss[:size // 2], apo[:size // 2], processes=2)
+    apf.process_block(ss[size // 2:], apo[size // 2:])
+
+    assert np.allclose(ap, apo, rtol=0, atol=1e-9)
+
+    # A (channels x samples) block is filtered channel by channel, each with
+    # its own state, and each channel may have its own coefficients. Empty
+    # (channels x 0) blocks leave every channel's state untouched.
+    stems = np.vstack([ss, rs, ss[::-1]])
+
+    mc = np.zeros_like(stems)
+    apf = AllpassFilter(44100, 18000, 0.1)
+    for i in range(0, size, 128):
+        apf.process_block(stems[:, i:i + 128], mc[:, i:i + 128])
+        apf.process_block(stems[:, i:i], mc[:, i:i])
+
+    for stem, out in zip(stems, mc):
+        y = np.zeros(size, dtype='d')
+        AllpassFilter(44100, 18000, 0.1).process_block(stem, y)
+        assert np.allclose(out, y)
+
+    f0s = np.array([440.0, 4400.0, 18000.0])
+    apf = AllpassFilter(44100, f0s, 0.1)
+    for i in range(0, size, 128):
+        apf.process_block(stems[:, i:i + 128], mc[:, i:i + 128])
+        apf.process_block(stems[:, i:i], mc[:, i:i])
+
+    for stem, out, f0 in zip(stems, mc, f0s):
+        y = np.zeros(size, dtype='d')
+        AllpassFilter(44100, f0, 0.1).process_block(stem, y)
+        assert np.array_equal(out, y)
+
     plt.figure()
     plt.subplot(211)
     plt.plot(x, rs - ss)
@@ -161,3 +445,59 @@ if __name__ == '__main__':
     plt.plot(x, ap - ss)
 
     plt.show()
+
+    # The coefficient table matches the allpass design closely between its
+    # grid points, to the accuracy given in its docstring...
+    f0s, Qs = [g.ravel() for g in np.meshgrid(
+        np.logspace(np.log10(30.0), np.log10(18000.0), 1000),
+        np.linspace(0.2, 8.0, 100))]
+
+    table = CoefficientTable(allpass, 44100)
+    b0, b1, b2, a0, a1, a2 = allpass(44100, f0s, Qs)
+    exact = np.column_stack([b0, b1, b2, a0, a1, a2]) / a0[:, np.newaxis]
+    assert np.abs(table.lookup(f0s, Qs) - exact).max() < 6e-4
+
+    # ...and a sweep through a modulated biquad carries its state and its
+    # sub-block clock across blocks, so processing in blocks of any size,
+    # empty ones included, swept or static, matches processing in one pass.
+    sweep = np.logspace(np.log10(200.0), np.log10(8000.0), size)
+
+    ms = np.zeros(size, dtype='d')
+    ModulatedBiquad(44100, 200.0, 0.7).process_block(ss, ms, f0=sweep)
+
+    for block_size in (100, 128, 441):
+        mb = np.zeros(size, dtype='d')
+        mbf = ModulatedBiquad(44100, 200.0, 0.7)
+        for i in range(0, size, block_size):
+            j = i + block_size
+            mbf.process_block(ss[i:j], mb[i:j], f0=sweep[i:j])
+            mbf.process_block(ss[j:j], mb[j:j], f0=sweep[j:j])
+            mbf.process_block(ss[j:j], mb[j:j])
+
+        assert np.array_equal(ms, mb)
+
+    # The coefficients are read at every multiple of the sub-block size, so
+    # 48 samples in, the filter runs on the set read at sample 32.
+    mbf = ModulatedBiquad(44100, 200.0, 0.7)
+    mbf.process_block(ss[:48], mb[:48], f0=sweep[:48])
+    c = mbf.table.lookup(sweep[[32]], np.full(1, 0.7))
+    assert np.allclose(mbf._b, c[0, :3]) and np.allclose(mbf._a, c[0, 3:])
+    assert mbf.f0 == sweep[32]
+
+    # In single precision, lfilter runs in float32 on float32 coefficients and
+    # state. Rounding the coefficients moves the poles slightly, so the output
+    # strays further from the double precision output than the oscillators do,
+    # but stays below -80dB.
+    ss32 = ss.astype(np.float32)
+
+    y32 = np.zeros(size, dtype=np.float32)
+    apf = AllpassFilter(44100, 18000, 0.1, dtype=np.float32)
+    apf.process_block(ss32, y32)
+    assert apf._zi.dtype == np.float32
+    assert np.abs(ap - y32).max() < 1e-4
+
+    m32 = np.zeros(size, dtype=np.float32)
+    mbf = ModulatedBiquad(44100, 200.0, 0.7, dtype=np.float32)
+    mbf.process_block(ss32, m32, f0=sweep)
+    assert mbf._zi.dtype == np.float32
+    assert np.abs(ms - m32).max() < 1e-4
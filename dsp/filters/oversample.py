@@ -0,0 +1,350 @@
+"""
+Module defining an oversampling wrapper, for running a filter at a multiple of
+the sampling frequency.
+
+Processing that generates new frequencies, such as the modulated allpass
+filters or clipping, folds whatever it generates above Nyquist back down into
+the audible band. Running it at a higher rate leaves room above the audible
+band for those frequencies, which are then filtered out before returning to the
+original rate. Wrapping just the filters that alias in an Oversampler means
+only they pay for the higher rate; the rest of a chain runs as it did.
+
+The rate is raised and lowered by a cascade of 2x stages, each a half-band FIR
+lowpass filter split into its two polyphase components. Every other tap of a
+half-band filter is zero, other than the center tap, so one component is a
+plain delay, and the other runs at the lower of the two rates of the stage:
+
+    up      y[2m] = 2 * sum of h[2j] * x[m - j]     (the FIR component)
+            y[2m + 1] = x[m - d]                    (the center tap, a delay)
+
+    down    y[m] = sum of h[2j] * x[2(m - j)] + 0.5 * x[2(m - d) - 1]
+
+with the FIR components run through `signal.lfilter`, whose state carries
+across blocks along with the delay lines. Each stage after the first works on
+a signal already band-limited by the stages before it, so it can get by with a
+far shorter filter.
+
+The stages are linear phase, and delay the signal by `latency` samples at the
+original rate in all, to be compensated for by the host like any other
+latency.
+"""
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from scipy import signal
+from wavetable.utils import Scratch
+from wavetable.wavetable import DTYPE
+
+def halfband(width, attenuation=90.0):
+    """
+    Returns the taps of a half-band lowpass FIR filter, designed with a Kaiser
+    window. The length of the filter is of the form 4m + 3, so that the center
+    tap falls on an odd index, and the taps on the even indices hold the rest
+    of the response.
+
+    Parameters
+    width : The width of the transition band, as a fraction of Nyquist, which
+            is centered on half Nyquist.
+    attenuation : The stopband attenuation, in dB.
+    """
+    numtaps, beta = signal.kaiserord(attenuation, width)
+    numtaps += (3 - numtaps) % 4
+
+    c = (numtaps - 1) // 2
+    n = np.arange(numtaps) - c
+    h = 0.5 * np.sinc(n / 2.0) * np.kaiser(numtaps, beta)
+
+    # The odd taps either side of the center are zero in theory, and are set
+    # to exactly zero here. The even taps are scaled to sum to exactly the
+    # center tap, so that both polyphase components pass DC at unit gain.
+    h[1::2] = 0.0
+    h[c] = 0.5
+    h[0::2] *= 0.5 / h[0::2].sum()
+
+    return h
+
+class _Delay(object):
+    """
+    A delay line of `length` samples along the last axis, starting at rest.
+    """
+
+    def __init__(self, length, dtype):
+        self.length = length
+        self.dtype = dtype
+        self._line = None
+        self._scratch = Scratch()
+
+    def process(self, x, out):
+        shape = x.shape[:-1] + (self.length,)
+        if self._line is None:
+            self._line = np.zeros(shape, dtype=self.dtype)
+        elif self._line.shape != shape:
+            raise Exception('Filter was started with a different number of '
+                    'channels.')
+
+        n = x.shape[-1]
+        line = self._scratch.get('line', x.shape[:-1] + (self.length + n,),
+                self.dtype)
+        line[..., :self.length] = self._line
+        line[..., self.length:] = x
+
+        np.copyto(out, line[..., :n])
+        np.copyto(self._line, line[..., n:])
+
+class HalfBand(object):
+    """
+    A single 2x stage, raising the rate of one signal and lowering that of
+    another through the same half-band filter, each with its own state.
+
+    Parameters
+    h : The taps of the half-band filter, as returned by `halfband`.
+    dtype : The dtype of the blocks and state.
+    """
+
+    def __init__(self, h, dtype=DTYPE):
+        self.dtype = np.dtype(dtype)
+        self._b = h[0::2].astype(self.dtype)
+        self._b2 = (2.0 * h[0::2]).astype(self.dtype)
+        self._a = np.ones(1, dtype=self.dtype)
+
+        # The center tap sits d samples into the odd component.
+        d = (len(h) - 3) // 4
+
+        # The group delay of the filter, in samples at the higher rate, for
+        # each of raising and lowering the rate.
+        self.latency = (len(h) - 1) // 2
+
+        self._up_zi = None
+        self._up_delay = _Delay(d, self.dtype)
+        self._down_zi = None
+        self._down_delay = _Delay(d + 1, self.dtype)
+        self._scratch = Scratch()
+
+    def _state(self, zi, x):
+        shape = x.shape[:-1] + (self._b.size - 1,)
+        if zi is None:
+            return np.zeros(shape, dtype=self.dtype)
+        if zi.shape != shape:
+            raise Exception('Filter was started with a different number of '
+                    'channels.')
+
+        return zi
+
+    def upsample(self, x, out):
+        """
+        Write the block `x` at twice the rate to `out`, which has twice as
+        many samples along its last axis.
+        """
+        self._up_zi = self._state(self._up_zi, x)
+        y, self._up_zi = signal.lfilter(self._b2, self._a, x, axis=-1,
+                zi=self._up_zi)
+
+        np.copyto(out[..., 0::2], y)
+        self._up_delay.process(x, out[..., 1::2])
+
+    def downsample(self, x, out):
+        """
+        Write the block `x` at half the rate to `out`, which has half as many
+        samples along its last axis.
+        """
+        center = self._scratch.get('center', out.shape, self.dtype)
+        self._down_delay.process(x[..., 1::2], center)
+        center *= 0.5
+
+        self._down_zi = self._state(self._down_zi, out)
+        y, self._down_zi = signal.lfilter(self._b, self._a, x[..., 0::2],
+                axis=-1, zi=self._down_zi)
+
+        np.copyto(out, y)
+        out += center
+
+class Oversampler(object):
+    """
+    Runs a filter at a multiple of the sampling frequency.
+
+    Parameters
+    filt : The filter to run at the higher rate, anything with a
+           `process_block(input, output)` method, set up for a sampling
+           frequency of `factor * fs`.
+    factor : The oversampling factor, a power of two; 2, 4 or 8, say.
+    passband : The fraction of the original Nyquist kept flat by the stages.
+    attenuation : The stopband attenuation of each stage, in dB.
+    fs : The original sampling frequency; 44.1kHz by default.
+    dtype : The dtype of the blocks and state.
+
+    Blocks may be 1D, or (channels x samples) arrays, in which case each
+    channel keeps its own state, as long as the wrapped filter allows it.
+    """
+
+    def __init__(self, filt, factor=2, passband=0.9, attenuation=90.0,
+            fs=44100., dtype=DTYPE):
+        if factor < 2 or factor & (factor - 1):
+            raise Exception('The oversampling factor must be a power of two.')
+        if not 0.0 < passband < 1.0:
+            raise Exception('The passband must be between 0 and 1.')
+
+        self.filter = filt
+        self.factor = factor
+        self.fs = float(fs)
+        self.dtype = np.dtype(dtype)
+
+        # Stage k runs between 2^k and 2^(k + 1) times the original rate. At
+        # the higher of the two, the band to keep flat reaches an edge of
+        # passband / 2^(k + 1) of Nyquist, and the transition band spans
+        # everything between the edge and its mirror image about half Nyquist.
+        self._stages = []
+        k = 0
+        while 2 ** k < factor:
+            width = 1.0 - passband / 2.0 ** k
+            self._stages.append(HalfBand(halfband(width, attenuation),
+                self.dtype))
+            k += 1
+
+        # Each stage delays the signal on the way up and again on the way
+        # down, by its latency in samples at its higher rate.
+        self.latency = sum(2.0 * stage.latency / 2 ** (k + 1)
+                for k, stage in enumerate(self._stages))
+
+        self._scratch = Scratch()
+
+    def process_block(self, input_buffer, output_buffer):
+        shape = input_buffer.shape[:-1]
+        n = input_buffer.shape[-1]
+        if n == 0:
+            return
+
+        scratch = self._scratch
+
+        # The block at each rate, from the original up. Those in between are
+        # written on the way up, and again on the way down.
+        levels = [input_buffer]
+        for k, stage in enumerate(self._stages):
+            level = scratch.get('level%d' % k, shape + (n * 2 ** (k + 1),),
+                    self.dtype)
+            stage.upsample(levels[-1], level)
+            levels.append(level)
+
+        wet = scratch.get('wet', levels[-1].shape, self.dtype)
+        self.filter.process_block(levels[-1], wet)
+
+        levels[0] = output_buffer
+        for k in reversed(range(len(self._stages))):
+            self._stages[k].downsample(wet, levels[k])
+            wet = levels[k]
+
+
+if __name__ == '__main__':
+    from filters.allpass import AllpassFilter
+
+    fs = 44100.
+    size = 65536
+
+    # Show the response of the stages of an 8x cascade, each at the higher of
+    # its two rates.
+    _, (ax1, ax2) = plt.subplots(2, sharex=True)
+
+    for k in range(3):
+        w, h = signal.freqz(halfband(1.0 - 0.9 / 2 ** k), worN=4096)
+        x = w * fs * 2 ** (k + 1) / (2 * np.pi)
+        ax1.plot(x, 20 * np.log10(abs(h) + 1e-12), color='c')
+        ax2.plot(x, np.unwrap(np.angle(h)), color='c')
+
+    ax1.set_title('Amplitude Response (dB)')
+    ax2.set_title('Phase Response (radians)')
+    ax1.axis('tight')
+    ax2.axis('tight')
+    ax1.grid()
+    ax2.grid()
+    plt.show()
+
+    class Identity(object):
+        def process_block(self, input_buffer, output_buffer):
+            np.copyto(output_buffer, input_buffer)
+
+    class Clipper(object):
+        def process_block(self, input_buffer, output_buffer):
+            np.clip(input_buffer, -0.5, 0.5, out=output_buffer)
+
+    # A sine of exactly `cycles` cycles over `size` samples, so that its
+    # spectrum, and that of anything periodic in it, falls on exact FFT bins.
+    cycles = 1001
+    t = np.arange(2 * size)
+    x = np.sin(2 * np.pi * cycles * t / float(size))
+
+    # With nothing in between, the stages pass the audible band through
+    # untouched other than the delay, which at 2x is a whole number of
+    # samples. The sine starts abruptly, so it is compared once the stages
+    # have settled.
+    for factor in (2, 4, 8):
+        over = Oversampler(Identity(), factor)
+        print('%dx latency: %.3f samples' % (factor, over.latency))
+
+    over = Oversampler(Identity(), 2)
+    y = np.zeros_like(x)
+    over.process_block(x, y)
+
+    latency = int(over.latency)
+    assert latency == over.latency
+    assert np.abs(y[size:] - x[size - latency:-latency]).max() < 1e-4
+
+    # The state carries across blocks, so streaming in blocks of any size,
+    # empty ones included, gives the same output as one large block.
+    for factor in (2, 4, 8):
+        whole = np.zeros(size)
+        Oversampler(AllpassFilter(0.5, 0.5, 1.0, fs * factor), factor,
+                fs=fs).process_block(x[:size], whole)
+
+        blocks = np.zeros(size)
+        over = Oversampler(AllpassFilter(0.5, 0.5, 1.0, fs * factor), factor,
+                fs=fs)
+        for i in range(0, size, 64):
+            over.process_block(x[i:i + 64], blocks[i:i + 64])
+            over.process_block(x[i:i], blocks[i:i])
+
+        assert np.allclose(whole, blocks, rtol=0, atol=1e-12)
+
+    # Clipping the sine generates harmonics far above Nyquist. At the original
+    # rate they fold back onto frequencies that aren't harmonics of the sine;
+    # oversampled, far less of them does. Past the first block everything is
+    # periodic, so the spectrum of the second holds just the harmonics, and
+    # whatever aliases between them. Only the passband is counted, since the
+    # stages let some of what lies just above it through.
+    def aliasing(y):
+        power = np.abs(np.fft.rfft(y[size:])) ** 2
+        power = power[:int(0.9 * size / 2)]
+        harmonics = power[::cycles].sum()
+        return 10 * np.log10((power.sum() - harmonics) / harmonics)
+
+    clipped = np.zeros_like(x)
+    Clipper().process_block(x, clipped)
+
+    levels = [aliasing(clipped)]
+    for factor in (2, 4, 8):
+        y = np.zeros_like(x)
+        Oversampler(Clipper(), factor).process_block(x, y)
+        levels.append(aliasing(y))
+
+    for factor, level in zip((1, 2, 4, 8), levels):
+        print('%dx aliasing: %.1f dB' % (factor, level))
+
+    assert levels[0] > levels[1] > levels[2] > levels[3]
+    assert levels[3] < levels[0] - 30.0
+
+    # Each channel of a (channels x samples) block is processed on its own.
+    stereo = np.vstack([x[:size], -0.5 * x[:size]])
+    out = np.zeros_like(stereo)
+    Oversampler(Clipper(), 4).process_block(stereo, out)
+
+    for channel, expected in zip(stereo, out):
+        y = np.zeros(size)
+        Oversampler(Clipper(), 4).process_block(channel, y)
+        assert np.allclose(y, expected, rtol=0, atol=1e-12)
+
+    # And in single precision, the stages match double precision.
+    y64 = np.zeros(size)
+    Oversampler(Identity(), 4).process_block(x[:size], y64)
+    y32 = np.zeros(size, dtype=np.float32)
+    Oversampler(Identity(), 4, dtype=np.float32).process_block(
+            x[:size].astype(np.float32), y32)
+    assert np.abs(y64 - y32).max() < 1e-5
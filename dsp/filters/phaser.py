@@ -0,0 +1,339 @@
+"""
+Module defining a phaser: a cascade of modulated allpass sections, mixed back
+in with the dry signal so that the phase shifts of the cascade turn into
+moving notches.
+
+The sections are either first-order allpass filters, modulated like the one in
+filters/allpass.py, or the RBJ biquad allpass filters of filters/biquad.py,
+swept in frequency. Each section has its own LFO, though the LFOs all share
+their settings unless given one value per section.
+
+Rather than chaining one filter object per section, each block is run through
+the whole cascade at once. The section coefficients are updated once per
+sub-block, and sub-blocks are aligned to an absolute sample clock so that the
+output doesn't depend on the block size. Without feedback, each sub-block is a
+single call to `signal.sosfilt`, with every section written as a second order
+section. With feedback, the output of the cascade is fed back into its input a
+sample later, so the cascade has to be stepped through sample by sample; that
+is done by one loop over the block running every section in turn, with the
+same structure as `signal.sosfilt`.
+
+That loop runs in the interpreter, so with feedback the cost of a block grows
+with the number of stages at Python speed, as it would for a chain of filter
+objects: an eight stage biquad phaser with feedback runs several times slower
+than one without. The `filter/phaser*` benchmark cases track both paths.
+
+The coefficients step from one sub-block to the next rather than ramping, as
+in filters/biquad.ModulatedBiquad, which a fast sweep can make audible as
+zipper noise. A smaller `sub_block` smooths the sweep, at the cost of more
+calls to `signal.sosfilt` per block, or more coefficient updates per block
+with feedback.
+"""
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from array import array
+from filters.biquad import CoefficientTable, allpass
+from scipy import signal
+from wavetable.oscillators import StandardOscillator
+from wavetable.utils import Scratch
+from wavetable.wavetable import DTYPE, WaveType
+
+def _cascade(sections, ends, x, z, last, feedback, y):
+    """
+    Runs `x` through a cascade of second order sections in transposed direct
+    form II, feeding `feedback` times each output back into the input of the
+    cascade for the next sample.
+
+    Parameters
+    sections : For each sub-block, a list of the (b0, b1, b2, a0, a1, a2)
+               coefficients of each section, normalized such that a0 = 1.
+    ends : The sample index at which each sub-block ends.
+    x : List of input samples.
+    z : List of the [z0, z1] state of each section, updated in place.
+    last : The output sample preceding the first output.
+    feedback : The feedback amount.
+    y : Python array to write the output samples to.
+
+    Returns the last output sample.
+    """
+    n = 0
+    for rows, end in zip(sections, ends):
+        while n < end:
+            v = x[n] + feedback * last
+
+            for (b0, b1, b2, _, a1, a2), s in zip(rows, z):
+                out = b0 * v + s[0]
+                s[0] = b1 * v - a1 * out + s[1]
+                s[1] = b2 * v - a2 * out
+                v = out
+
+            y[n] = last = v
+            n += 1
+
+    return last
+
+def _first_order_cascade(coeffs, ends, x, z, last, feedback, y):
+    """
+    `_cascade` for first-order allpass sections, H(z) = (c + z^-1) / (1 + c
+    z^-1), which leave out the terms that are always zero.
+
+    Parameters
+    coeffs : For each sub-block, a list of the coefficient c of each section.
+    z : List of the z0 state of each section (z1 is always zero).
+
+    The rest are as in `_cascade`.
+    """
+    n = 0
+    for cs, end in zip(coeffs, ends):
+        sections = list(enumerate(cs))
+
+        while n < end:
+            v = x[n] + feedback * last
+
+            for k, c in sections:
+                out = c * v + z[k]
+                z[k] = v - c * out
+                v = out
+
+            y[n] = last = v
+            n += 1
+
+    return last
+
+class Phaser(object):
+    """
+    A phaser built from a cascade of modulated allpass sections.
+
+    Each section's LFO runs at `rate` Hz from its start `phase` (in cycles),
+    and is scaled by `amplitude` about `offset`. For first-order sections these
+    set the coefficient just as in allpass.AllpassFilter. For biquad sections
+    they set the position of the center frequency between `f_range[0]` and
+    `f_range[1]` on a log scale, from 0 to 1.
+
+    Parameters
+    stages : The number of allpass sections.
+    rate : LFO rate (Hz), per section or shared.
+    offset : [0.0, 1.0] : LFO center, per section or shared.
+    amplitude : [0.0, 1.0] : LFO amplitude, per section or shared.
+    phase : LFO start phase in cycles, per section or shared.
+    feedback : (-1.0, 1.0) : The amount of the wet signal fed back into the
+               cascade. Any feedback runs the cascade sample by sample in
+               Python; see above.
+    mix : [0.0, 1.0] : The amount of the wet signal in the output.
+    sections : 'first' for first-order sections, or 'biquad' for RBJ biquads.
+    Q : Quality of the biquad sections.
+    f_range : The range swept by the biquad sections (Hz).
+    sub_block : The number of samples between coefficient updates, which
+                step rather than ramp from one to the next.
+    fs : The sampling frequency; 44.1kHz by default.
+    dtype : The dtype of the sections and their state. The LFOs are computed in
+            double precision, from the sample clock.
+    """
+
+    def __init__(self, stages, rate, offset=0.5, amplitude=1.0, phase=0.0,
+            feedback=0.0, mix=0.5, sections='first', Q=0.7,
+            f_range=(200., 8000.), sub_block=64, fs=44100., dtype=DTYPE):
+        if sections not in ('first', 'biquad'):
+            raise Exception('Sections must be first or biquad.')
+        if not -1.0 < feedback < 1.0:
+            raise Exception('Feedback must be between -1 and 1.')
+
+        self.stages = stages
+        self.feedback = feedback
+        self.mix = mix
+        self.sections = sections
+        self.sub_block = sub_block
+        self.fs = float(fs)
+        self.dtype = np.dtype(dtype)
+
+        rate, offset, amplitude, phase = [np.broadcast_to(p, (stages,))
+                for p in (rate, offset, amplitude, phase)]
+
+        # LFO angular rates and phases, in radians.
+        self._omega = 2.0 * np.pi * rate / self.fs
+        self._phase = 2.0 * np.pi * phase
+
+        if sections == 'first':
+            # The same limits on the coefficient as allpass.AllpassFilter.
+            mmax = 0.82
+            mmin = -0.05
+            self._center = mmin + offset * (mmax - mmin)
+            self._amp = np.minimum(amplitude, mmax - self._center)
+        else:
+            self._center = np.asarray(offset, dtype='d')
+            self._amp = np.asarray(amplitude, dtype='d')
+            self._f_range = f_range
+            self._Q = Q
+            self._table = CoefficientTable(allpass, self.fs,
+                    f_range=f_range, q_range=(Q, 2.0 * Q), q_steps=2)
+
+        # The state of each section, in the form used by `signal.sosfilt`,
+        # the last output for the feedback path, and the absolute sample clock
+        # driving the LFOs.
+        self._zi = np.zeros((stages, 2), dtype=self.dtype)
+        self._last = 0.0
+        self._clock = 0
+
+        self._scratch = Scratch()
+        self._out = array(self.dtype.char)
+
+    def coefficients(self, t):
+        """
+        Returns a (len(t) x stages x 6) array of the normalized second order
+        section coefficients of every section at each of the sample times `t`.
+        """
+        lfo = np.multiply.outer(t, self._omega)
+        lfo += self._phase
+        np.sin(lfo, out=lfo)
+        lfo *= self._amp
+        lfo += self._center
+
+        if self.sections == 'biquad':
+            np.clip(lfo, 0.0, 1.0, out=lfo)
+            f_min, f_max = self._f_range
+            f0 = f_min * (f_max / float(f_min)) ** lfo.ravel()
+            Q = np.full(f0.size, self._Q)
+            return self._table.lookup(f0, Q).reshape(lfo.shape + (6,))
+
+        # H(z) = (c + z^-1) / (1 + c z^-1)
+        sos = np.zeros(lfo.shape + (6,))
+        sos[..., 0] = lfo
+        sos[..., 1] = 1.0
+        sos[..., 3] = 1.0
+        sos[..., 4] = lfo
+        return sos
+
+    def process_block(self, input_buffer, output_buffer):
+        n = input_buffer.size
+        if n == 0:
+            return
+
+        step = self.sub_block
+
+        # The sub-blocks touched by this block, and where each ends within it.
+        first = self._clock // step
+        count = (self._clock + n - 1) // step - first + 1
+        starts = (first + np.arange(count)) * step
+        ends = np.minimum(starts + step - self._clock, n)
+
+        sos = self.coefficients(starts.astype('d')).astype(self.dtype,
+                copy=False)
+        wet = self._scratch.get('wet', n, self.dtype)
+
+        if self.feedback == 0.0:
+            start = 0
+            for k, end in enumerate(ends):
+                y, self._zi = signal.sosfilt(sos[k], input_buffer[start:end],
+                        zi=self._zi)
+                wet[start:end] = y
+                start = end
+
+            self._last = float(wet[-1])
+        else:
+            if len(self._out) < n:
+                self._out = array(self.dtype.char, [0.0]) * n
+
+            if self.sections == 'first':
+                z = self._zi[:, 0].tolist()
+                self._last = _first_order_cascade(sos[:, :, 0].tolist(),
+                        ends.tolist(), input_buffer.tolist(), z, self._last,
+                        self.feedback, self._out)
+                self._zi[:, 0] = z
+            else:
+                z = self._zi.tolist()
+                self._last = _cascade(sos.tolist(), ends.tolist(),
+                        input_buffer.tolist(), z, self._last, self.feedback,
+                        self._out)
+                self._zi[:] = z
+            np.copyto(wet, np.frombuffer(self._out, dtype=self.dtype,
+                count=n))
+
+        # output = (1 - mix) * input + mix * wet
+        np.multiply(input_buffer, 1.0 - self.mix, out=output_buffer)
+        wet *= self.mix
+        output_buffer += wet
+
+        self._clock += n
+
+
+if __name__ == '__main__':
+    # Show the response of an eight stage cascade at a few points in its LFO
+    # cycle; each section adds pi of phase shift at its center, and the dry
+    # mix turns every 2 pi into a notch.
+    _, (ax1, ax2) = plt.subplots(2, sharex=True)
+
+    phaser = Phaser(8, 0.5)
+    for t in np.linspace(0.0, 44100.0, 5):
+        sos = phaser.coefficients(np.array([t]))[0]
+        w, h = signal.sosfreqz(sos)
+        x = w * phaser.fs / (2 * np.pi)
+
+        ax1.plot(x, 20 * np.log10(abs(0.5 + 0.5 * h) + 1e-9), color='c')
+        ax2.plot(x, np.unwrap(np.angle(h)), color='c')
+
+    ax1.set_title('Amplitude Response (dB)')
+    ax2.set_title('Cascade Phase Response (radians)')
+    plt.show()
+
+    # Now run a sawtooth through an eight stage phaser, with and without
+    # feedback, and with biquad sections on twelve stages.
+    fs = 44100
+    size = fs
+    ss = np.zeros(size, dtype='d')
+    StandardOscillator(WaveType.SAWTOOTH, 43.65, 0.0, 1.0).render(ss)
+
+    settings = [
+        dict(stages=8, rate=0.5),
+        dict(stages=8, rate=0.5, feedback=0.7),
+        dict(stages=12, rate=[0.3, 0.5] * 6, sections='biquad'),
+    ]
+
+    for kwargs in settings:
+        # The LFOs and sub-blocks run on an absolute clock, so the output is
+        # the same whatever the block size, empty blocks included.
+        ps = np.zeros(size, dtype='d')
+        Phaser(**kwargs).process_block(ss, ps)
+
+        pb = np.zeros(size, dtype='d')
+        phaser = Phaser(**kwargs)
+        for i in range(0, size, 100):
+            phaser.process_block(ss[i:i + 100], pb[i:i + 100])
+            phaser.process_block(ss[i:i], pb[i:i])
+
+        assert np.array_equal(ps, pb)
+
+        # In single precision, the sections run in float32, and the output
+        # stays within the error of rounding their coefficients.
+        p32 = np.zeros(size, dtype=np.float32)
+        phaser = Phaser(dtype=np.float32, **kwargs)
+        phaser.process_block(ss.astype(np.float32), p32)
+
+        assert phaser._zi.dtype == np.float32
+        assert np.abs(ps - p32).max() < 1e-4
+
+    # The feedback kernels run the same sections as sosfilt, so they give the
+    # same wet signal when run without feedback.
+    ps = np.zeros(size, dtype='d')
+    Phaser(8, 0.5, mix=1.0).process_block(ss, ps)
+
+    phaser = Phaser(8, 0.5)
+    sos = phaser.coefficients(np.arange(0.0, size, phaser.sub_block))
+    ends = np.minimum(np.arange(1, sos.shape[0] + 1) * phaser.sub_block, size)
+
+    pk = array('d', [0.0]) * size
+    _cascade(sos.tolist(), ends.tolist(), ss.tolist(),
+            np.zeros((8, 2)).tolist(), 0.0, 0.0, pk)
+
+    assert np.allclose(ps, pk)
+
+    pk = array('d', [0.0]) * size
+    _first_order_cascade(sos[:, :, 0].tolist(), ends.tolist(), ss.tolist(),
+            [0.0] * 8, 0.0, 0.0, pk)
+
+    assert np.allclose(ps, pk)
+
+    plt.figure()
+    plt.plot(np.arange(size), ps)
+    plt.show()
@@ -2,42 +2,49 @@
 
 """
 Script for generating a series of band-limited wavetables and writing the result
-out to a PCM file (commonly referred to as mipmapping, drawing the comparison to
+out to a file (commonly referred to as mipmapping, drawing the comparison to
 the similar process in computer graphics).
 
-Here we build 128 tables corresponding to the MIDI note range, such that each
-MIDI note renders from a band-limited wavetable with exactly the right number
-of harmonics, for each of the four wave types availabile in
-wavetable/wavetable.py.
+Here we split the MIDI note range into a configurable number of tables per
+octave, such that each MIDI note renders from a band-limited wavetable with no
+more harmonics than fit below Nyquist, for each of the four wave types
+availabile in wavetable/wavetable.py. See wavetable/mipmap.py for the format
+of the resulting file.
 
-N.B. (1): Most of the implementations I've seen for this use far fewer tables,
-usually something like 3 tables per octave. In that case, you have to be a
-little more careful about mapping note frequencies to the appropriate range, but
-the computational cost there is well worth the memory saved. Additionally, this
-script produces 128 identical tables for the sine wave (because band-limiting a
-sine wave has no effect) for simplicity, which you would never really want to
-do in a high performance plugin.
+N.B. (1): Passing 12 tables per octave builds a table for every MIDI note, each
+with exactly the right number of harmonics. Most of the implementations I've
+seen use far fewer tables, usually something like 3 tables per octave (the
+default here), where each table is band-limited for the highest note in its
+range. Only distinct tables are written, so the sine wave, which band-limiting
+has no effect on, is stored just once.
 
-N.B. (2): The Unix tool `xxd` is really useful for converting the resulting PCM
+N.B. (2): The Unix tool `xxd` is really useful for converting the resulting
 file to a C-style array literal, making it very easy to build into your plugin
 binary.
-"""
 
-import numpy as np
+N.B. (3): Passing a minimum table size (e.g. `-m 64`) shrinks the tables for the
+higher ranges, which carry fewer partials, down to that size.
+"""
 
-from wavetable import wavetable
-from wavetable.utils import normalize, note_to_freq, write_pcm
+import argparse
 
-NUM_RANGES = 128
-NUM_TYPES = 4
+from wavetable import mipmap, wavetable
 
 if __name__ == '__main__':
-    tables = []
-    for i in range(NUM_TYPES):
-        for j in range(NUM_RANGES):
-            fq = note_to_freq(j)
-            table = wavetable.build(i, fq)
-            tables.append(table)
-
-    mipmap = np.concatenate(tables)
-    write_pcm('mipmap.pcm', mipmap)
+    parser = argparse.ArgumentParser(description='Write a wavetable mipmap.')
+    parser.add_argument('-t', '--tables-per-octave', type=int, default=3,
+            help='number of tables spanning each octave (1-12)')
+    parser.add_argument('-r', '--sample-rate', type=float,
+            default=wavetable.SAMPLE_RATE,
+            help='sample rate the tables will be played back at')
+    parser.add_argument('-s', '--table-size', type=int,
+            default=wavetable.TABLE_SIZE,
+            help='size of the largest table, a power of two')
+    parser.add_argument('-m', '--min-table-size', type=int, default=None,
+            help='shrink the tables for higher ranges down to this size')
+    parser.add_argument('-o', '--output', default='mipmap.pcm',
+            help='output file name')
+    args = parser.parse_args()
+
+    mipmap.write(args.output, args.tables_per_octave, args.sample_rate,
+            args.table_size, args.min_table_size)
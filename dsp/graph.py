@@ -0,0 +1,319 @@
+"""
+Module defining a small pull-based graph for block processing.
+
+Nodes wrap the oscillators and filters, and each edge carries one fixed-size
+block from a node to the nodes reading it. Compiling a graph for a block size
+sorts its nodes topologically from the output node, and assigns each node an
+output buffer from a pool allocated up front. A buffer goes back to the pool
+once the last node reading it has run, so a chain of filters needs only two
+buffers however long it is.
+
+Once compiled, processing a block just runs each node in order against its
+preassigned buffers. The oscillators and the first-order AllpassFilter do all
+their work in scratch space reused from block to block, so a graph of these
+allocates no new arrays in the steady state. The BiquadFilter and its
+subclasses are the exception: scipy's `lfilter` returns new arrays for its
+output and final state on every call.
+"""
+
+import numpy as np
+
+from wavetable.wavetable import DTYPE
+
+class Node(object):
+    """
+    A node in the processing graph, producing one block of samples from the
+    blocks produced by its inputs.
+
+    Parameters
+    inputs : The nodes whose output blocks this node reads.
+    """
+
+    # An optional name for the node, which instrumentation reports its timing
+    # under (see instrument.py).
+    name = None
+
+    def __init__(self, *inputs):
+        self.inputs = list(inputs)
+
+    def prepare(self, block_size, dtype):
+        """
+        Called when the graph is compiled, before any block is processed, so
+        that nodes may allocate whatever they need for the given block size
+        and dtype.
+        """
+        pass
+
+    def process(self, inputs, output):
+        """
+        Write the next block to `output`, given the blocks produced by each of
+        the nodes in `self.inputs`.
+        """
+        raise NotImplementedError
+
+class OscillatorNode(Node):
+    """
+    A source node rendering one of the oscillators.
+
+    Parameters
+    oscillator : The oscillator to render.
+    """
+
+    def __init__(self, oscillator):
+        Node.__init__(self)
+        self.oscillator = oscillator
+
+    def process(self, inputs, output):
+        # The oscillators sum into the buffer they're given.
+        output.fill(0.0)
+        self.oscillator.render(output)
+
+class FilterNode(Node):
+    """
+    A node running its input through one of the filters.
+
+    Parameters
+    filt : The filter, anything with a `process_block(input, output)` method.
+    source : The node to read from.
+    """
+
+    def __init__(self, filt, source):
+        Node.__init__(self, source)
+        self.filter = filt
+
+    def process(self, inputs, output):
+        self.filter.process_block(inputs[0], output)
+
+class MixNode(Node):
+    """
+    A node summing its inputs, each scaled by an optional gain.
+
+    Parameters
+    inputs : The nodes to mix.
+    gains : Optional list of gains, one per input.
+    """
+
+    def __init__(self, inputs, gains=None):
+        Node.__init__(self, *inputs)
+
+        if gains is not None and len(gains) != len(self.inputs):
+            raise Exception('Expected one gain per input.')
+
+        self.gains = gains
+
+    def prepare(self, block_size, dtype):
+        self._scaled = np.zeros(block_size, dtype=dtype)
+
+    def process(self, inputs, output):
+        if self.gains is None:
+            np.copyto(output, inputs[0])
+            for block in inputs[1:]:
+                output += block
+            return
+
+        np.multiply(inputs[0], self.gains[0], out=output)
+        for block, gain in zip(inputs[1:], self.gains[1:]):
+            np.multiply(block, gain, out=self._scaled)
+            output += self._scaled
+
+class Graph(object):
+    """
+    A graph of nodes, processed by pulling blocks from its output node.
+
+    Parameters
+    output : The node producing the output of the graph.
+    dtype : The dtype of the blocks passed between nodes, which should match
+            that of the oscillators and filters.
+    """
+
+    def __init__(self, output, dtype=DTYPE):
+        self.output = output
+        self.dtype = np.dtype(dtype)
+        self.block_size = None
+        self.buffers = []
+        self._schedule = []
+
+    def compile(self, block_size):
+        """
+        Order the nodes for processing and assign each an output buffer for
+        blocks of the given size, allocating every buffer up front.
+        """
+        order = self._sort()
+
+        # The position in the order of the last node to read each node.
+        last_read = {}
+        for i, node in enumerate(order):
+            for source in node.inputs:
+                last_read[source] = i
+
+        self.buffers = []
+        assigned = {}
+        pool = []
+
+        for i, node in enumerate(order):
+            # Take the node's buffer before releasing those of its inputs, so
+            # that no node writes over a block it is still reading.
+            if pool:
+                assigned[node] = pool.pop()
+            else:
+                assigned[node] = np.zeros(block_size, dtype=self.dtype)
+                self.buffers.append(assigned[node])
+
+            for source in set(node.inputs):
+                if last_read[source] == i:
+                    pool.append(assigned[source])
+
+        self._schedule = []
+        for node in order:
+            node.prepare(block_size, self.dtype)
+            inputs = [assigned[source] for source in node.inputs]
+            self._schedule.append((node, inputs, assigned[node]))
+
+        self.block_size = block_size
+
+    def _sort(self):
+        """
+        Returns the nodes feeding the output node, including itself, in an
+        order where each node comes after all of its inputs.
+        """
+        order = []
+        visiting = set()
+        visited = set()
+
+        def visit(node):
+            if node in visited:
+                return
+            if node in visiting:
+                raise Exception('Processing graph contains a cycle.')
+
+            visiting.add(node)
+            for source in node.inputs:
+                visit(source)
+            visiting.remove(node)
+
+            visited.add(node)
+            order.append(node)
+
+        visit(self.output)
+        return order
+
+    def process(self, out=None):
+        """
+        Process the next block through the graph, returning the block produced
+        by the output node. The returned buffer belongs to the graph and is
+        overwritten by the next call, so it is also copied to `out` if given.
+        """
+        if self.block_size is None:
+            raise Exception('Graph must be compiled before processing.')
+
+        for node, inputs, output in self._schedule:
+            node.process(inputs, output)
+
+        result = self._schedule[-1][2]
+        if out is not None:
+            np.copyto(out, result)
+
+        return result
+
+if __name__ == '__main__':
+    from filters import biquad
+    from filters.allpass import AllpassFilter
+    from wavetable.oscillators import StandardOscillator
+    from wavetable.wavetable import SAMPLE_RATE, WaveType
+
+    def chain():
+        oscs = [StandardOscillator(WaveType.SAWTOOTH, 110.0, d, 1.0)
+                for d in (-7.0, 0.0, 7.0)]
+        filters = [AllpassFilter(0.5, 1.0, r) for r in (0.3, 0.5, 0.7)]
+        return oscs, filters
+
+    # A detuned trio, mixed and run through a chain of modulated allpass
+    # filters, rendered block by block through the graph...
+    oscs, filters = chain()
+    node = MixNode([OscillatorNode(osc) for osc in oscs], [0.2, 0.5, 0.3])
+    for filt in filters:
+        node = FilterNode(filt, node)
+
+    graph = Graph(node)
+    graph.compile(128)
+
+    # The chain of filters reuses the buffers freed by the oscillators once
+    # they've been mixed, so the whole graph needs just four buffers.
+    assert len(graph.buffers) == 4
+
+    n = 128 * 64
+    y = np.zeros(n)
+    for i in range(0, n, 128):
+        graph.process(y[i:i + 128])
+
+    # ...matches rendering each component by hand over the whole signal.
+    oscs, filters = chain()
+    x = np.zeros(n)
+    for osc, gain in zip(oscs, [0.2, 0.5, 0.3]):
+        block = np.zeros(n)
+        osc.render(block)
+        x += gain * block
+
+    for filt in filters:
+        out = np.zeros(n)
+        filt.process_block(x, out)
+        x = out
+
+    assert np.allclose(x, y)
+
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    def traced(graph, block, count=256):
+        """
+        Returns how much traced memory grew over `count` blocks, once the
+        graph has warmed up, and its peak over them.
+        """
+        for _ in range(16):
+            graph.process(block)
+
+        tracemalloc.start()
+        start, _ = tracemalloc.get_traced_memory()
+        for _ in range(count):
+            graph.process(block)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return current - start, peak - start
+
+    # In the steady state, the same graph allocates nothing per block: the
+    # interpreter's own churn between blocks stays well under what a single
+    # block's array would take. The blocks are large enough for one to stand
+    # out.
+    if tracemalloc is not None:
+        block = np.zeros(512)
+        graph = Graph(node)
+        graph.compile(block.size)
+        growth, peak = traced(graph, block)
+        assert growth < block.nbytes
+        assert peak < block.nbytes
+
+    # The biquad doesn't leak either, but its peak shows the arrays `lfilter`
+    # allocates for every block.
+    if tracemalloc is not None:
+        osc = StandardOscillator(WaveType.SAWTOOTH, 110.0, 0.0, 1.0)
+        node = FilterNode(biquad.AllpassFilter(SAMPLE_RATE, 1000.0, 0.7),
+                OscillatorNode(osc))
+        graph = Graph(node)
+        graph.compile(block.size)
+        growth, peak = traced(graph, block)
+        assert growth < 2 * block.nbytes
+        assert peak > block.nbytes
+
+    # Feedback paths aren't supported.
+    a = Node()
+    b = Node(a)
+    a.inputs.append(b)
+    try:
+        Graph(b).compile(128)
+    except Exception as e:
+        assert 'cycle' in str(e)
+    else:
+        raise AssertionError('Expected compile to reject the cycle.')
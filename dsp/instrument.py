@@ -0,0 +1,392 @@
+"""
+Module for opt-in instrumentation of the hot paths: oscillator `render`, filter
+`process_block`, `wavetable.build` and the `process` of each graph node.
+
+Instrumentation works by swapping the instrumented methods on their classes
+(and `build` on its module) for timing wrappers when enabled, and swapping the
+originals back when disabled, so while disabled it costs nothing at all: the
+methods called are the original ones. While enabled it applies to every
+instance in the process.
+
+For each instrumented method (or named graph node), the wrappers record
+
+    calls       the number of calls
+    samples     the number of samples processed
+    seconds     the total time spent in the calls
+    histogram   call latencies, in power of two buckets of microseconds
+    misses      the number of calls that took longer than their budget, the
+                duration of the samples they processed at the sample rate of
+                the object processing them
+    allocated   optionally, the peak memory allocated by each call, traced by
+                tracemalloc; this slows every call down considerably
+
+A call made from within another call of the same kind, such as the render of
+the StandardOscillator inside a ResamplingOscillator, is left to the outer
+call, so that the same time isn't counted twice. Tables are built from within
+renders though, and are counted both on their own and as part of the render.
+
+Results are read with `snapshot`, as a dict, or `log_line`, as one line of
+text, which `start_logging` writes to a logger periodically.
+"""
+
+import bisect
+import functools
+import logging
+import threading
+import timeit
+
+import graph
+
+from filters import allpass, biquad, oversample, phaser
+from wavetable import oscillators, wavetable
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# The upper edges of the latency histogram buckets, in microseconds, from 1us
+# up to about a second. Slower calls land in a final, unbounded bucket.
+BUCKETS = [2 ** k for k in range(21)]
+
+# The methods instrumented, by the kind of call they make.
+METHODS = [
+    ('render', oscillators.StandardOscillator),
+    ('render', oscillators.ResamplingOscillator),
+    ('render', oscillators.RealTimeResamplingOscillator),
+    ('render', oscillators.UnisonOscillator),
+    ('process_block', allpass.AllpassFilter),
+    ('process_block', biquad.BiquadFilter),
+    ('process_block', biquad.ModulatedBiquad),
+    ('process_block', phaser.Phaser),
+    ('process_block', oversample.Oversampler),
+    ('process', graph.OscillatorNode),
+    ('process', graph.FilterNode),
+    ('process', graph.MixNode),
+]
+
+class Stats(object):
+    """
+    The measurements recorded for one instrumented method or graph node.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.samples = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.misses = 0
+        self.allocated = 0
+        self.max_allocated = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def record(self, seconds, samples, budget, allocated):
+        self.calls += 1
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.histogram[bisect.bisect_left(BUCKETS, seconds * 1e6)] += 1
+
+        if samples is not None:
+            self.samples += samples
+        if budget is not None and seconds > budget:
+            self.misses += 1
+        if allocated is not None:
+            self.allocated += allocated
+            self.max_allocated = max(self.max_allocated, allocated)
+
+    def percentile(self, q):
+        """
+        Returns an upper bound on the given percentile of the call latency,
+        in seconds, from the edges of the histogram buckets.
+        """
+        target = q / 100.0 * self.calls
+        count = 0
+        for edge, n in zip(BUCKETS, self.histogram):
+            count += n
+            if count >= target:
+                return edge * 1e-6
+
+        return self.max
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'samples': self.samples,
+            'seconds': self.seconds,
+            'mean': self.seconds / self.calls if self.calls else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'misses': self.misses,
+            'allocated': self.allocated,
+            'max_allocated': self.max_allocated,
+            'histogram': list(self.histogram),
+        }
+
+class _State(object):
+    """
+    Everything the module holds while instrumentation is enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = wavetable.SAMPLE_RATE
+        self.allocations = False
+        self.traced = False
+
+        # The original methods, to be restored on disable.
+        self.originals = []
+
+        self.stats = {}
+        self.lock = threading.Lock()
+
+        # Per thread, the kinds of call in progress and how deeply nested the
+        # current call is.
+        self.local = threading.local()
+
+        self.logger = None
+
+_state = _State()
+
+def _call(key, kind, samples, rate, fn, *args, **kwargs):
+    """
+    Call `fn`, recording the call under `key` unless a call of the same kind
+    is already in progress on this thread.
+    """
+    local = _state.local
+    active = getattr(local, 'active', None)
+    if active is None:
+        active = local.active = set()
+        local.depth = 0
+
+    if kind in active:
+        return fn(*args, **kwargs)
+
+    # Allocations are measured by the outermost call only, since measuring
+    # resets the peak traced by tracemalloc.
+    measure = _state.allocations and local.depth == 0
+    if measure:
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    active.add(kind)
+    local.depth += 1
+    t = timeit.default_timer()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        seconds = timeit.default_timer() - t
+        local.depth -= 1
+        active.discard(kind)
+
+        allocated = None
+        if measure:
+            allocated = max(tracemalloc.get_traced_memory()[1] - start, 0)
+
+        budget = None
+        if samples is not None and rate:
+            budget = samples / float(rate)
+
+        with _state.lock:
+            stats = _state.stats.get(key)
+            if stats is None:
+                stats = _state.stats[key] = Stats()
+            stats.record(seconds, samples, budget, allocated)
+
+def _wrap(kind, cls, original):
+    module = cls.__module__.split('.')[-1]
+
+    if kind == 'render':
+        def wrapper(self, buf, *args, **kwargs):
+            key = '%s.%s.render' % (module, self.__class__.__name__)
+            return _call(key, kind, buf.shape[-1], self.sample_rate, original,
+                    self, buf, *args, **kwargs)
+    elif kind == 'process_block':
+        def wrapper(self, input_buffer, *args, **kwargs):
+            key = '%s.%s.process_block' % (module, self.__class__.__name__)
+            return _call(key, kind, input_buffer.shape[-1], self.fs,
+                    original, self, input_buffer, *args, **kwargs)
+    else:
+        def wrapper(self, inputs, output):
+            key = 'graph.%s' % (self.name or self.__class__.__name__)
+            return _call(key, kind, output.shape[-1], _state.sample_rate,
+                    original, self, inputs, output)
+
+    return functools.wraps(original)(wrapper)
+
+def enable(sample_rate=wavetable.SAMPLE_RATE, allocations=False):
+    """
+    Start instrumenting the hot paths.
+
+    Parameters
+    sample_rate : The sample rate that the budget of graph nodes, which don't
+                  have one of their own, is computed at.
+    allocations : Whether to trace the memory allocated by each call, which
+                  requires tracemalloc.
+    """
+    if _state.enabled:
+        disable()
+
+    if allocations:
+        if tracemalloc is None or not hasattr(tracemalloc, 'reset_peak'):
+            raise Exception('Tracing allocations requires tracemalloc.')
+        _state.traced = not tracemalloc.is_tracing()
+        if _state.traced:
+            tracemalloc.start()
+
+    _state.sample_rate = sample_rate
+    _state.allocations = allocations
+
+    for kind, cls in METHODS:
+        original = vars(cls)[kind]
+        _state.originals.append((cls, kind, original))
+        setattr(cls, kind, _wrap(kind, cls, original))
+
+    build = wavetable.build
+    _state.originals.append((wavetable, 'build', build))
+
+    @functools.wraps(build)
+    def instrumented_build(*args, **kwargs):
+        return _call('wavetable.build', 'build', None, None, build, *args,
+                **kwargs)
+
+    wavetable.build = instrumented_build
+    _state.enabled = True
+
+def disable():
+    """
+    Stop instrumenting, restoring the original methods. The results so far
+    are kept until `reset`.
+    """
+    for owner, name, original in reversed(_state.originals):
+        setattr(owner, name, original)
+    _state.originals = []
+
+    if _state.traced:
+        tracemalloc.stop()
+        _state.traced = False
+
+    _state.allocations = False
+    _state.enabled = False
+
+def enabled():
+    return _state.enabled
+
+def reset():
+    """
+    Discard the results recorded so far.
+    """
+    with _state.lock:
+        _state.stats.clear()
+
+def snapshot():
+    """
+    Returns the results recorded so far, as a dict mapping each instrumented
+    method or graph node to a dict of its measurements.
+    """
+    with _state.lock:
+        return dict((key, stats.snapshot())
+                for key, stats in _state.stats.items())
+
+def log_line(results=None):
+    """
+    Returns a one line summary of the given snapshot, or of the results so
+    far, with the busiest entries first.
+    """
+    if results is None:
+        results = snapshot()
+
+    entries = sorted(results.items(), key=lambda item: -item[1]['seconds'])
+    parts = []
+    for key, r in entries:
+        part = '%s: %d calls, %.1fms, mean %.0fus, p99 <%.0fus' % (key,
+                r['calls'], r['seconds'] * 1e3, r['mean'] * 1e6,
+                r['p99'] * 1e6)
+        if r['misses']:
+            part += ', %d missed' % r['misses']
+        parts.append(part)
+
+    return ' | '.join(parts) or 'no calls recorded'
+
+class _Logger(threading.Thread):
+
+    def __init__(self, interval, logger):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.logger = logger
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.logger.info(log_line())
+
+def start_logging(interval=10.0, logger=None):
+    """
+    Log `log_line` every `interval` seconds from a background thread, to the
+    given logger or the 'dsp.instrument' logger by default.
+    """
+    stop_logging()
+
+    _state.logger = _Logger(interval,
+            logger or logging.getLogger('dsp.instrument'))
+    _state.logger.start()
+
+def stop_logging():
+    if _state.logger is not None:
+        _state.logger.stopped.set()
+        _state.logger.join()
+        _state.logger = None
+
+if __name__ == '__main__':
+    from wavetable.wavetable import WaveType
+
+    StandardOscillator = oscillators.StandardOscillator
+    render = vars(StandardOscillator)['render']
+
+    def run(blocks, sample_rate=wavetable.SAMPLE_RATE):
+        osc = StandardOscillator(WaveType.SAWTOOTH, 110.0, 3.0, 1.0,
+                sample_rate=sample_rate)
+        node = graph.FilterNode(biquad.AllpassFilter(44100, 1000.0, 0.7),
+                graph.OscillatorNode(osc))
+        node.name = 'allpass'
+
+        g = graph.Graph(node)
+        g.compile(256)
+        for _ in range(blocks):
+            g.process()
+
+    originals = [getattr(cls, kind) for kind, cls in METHODS]
+
+    # While enabled, every call is recorded, with the latencies of each in the
+    # histogram.
+    enable()
+    run(100)
+
+    results = snapshot()
+    osc = results['oscillators.StandardOscillator.render']
+    assert osc['calls'] == 100 and osc['samples'] == 25600
+    assert sum(osc['histogram']) == 100
+    assert osc['p50'] <= osc['p99']
+    assert results['graph.allpass']['calls'] == 100
+    assert results['graph.OscillatorNode']['calls'] == 100
+    assert results['biquad.AllpassFilter.process_block']['calls'] == 100
+    assert results['wavetable.build']['calls'] == 1
+
+    print(log_line(results))
+
+    # An oscillator running at an absurd sample rate has next to no time for
+    # each block, so every block misses its deadline.
+    reset()
+    run(10, sample_rate=1e12)
+    assert snapshot()['oscillators.StandardOscillator.render']['misses'] == 10
+
+    # Once disabled, the original methods are back in place, and nothing more
+    # is recorded.
+    disable()
+    assert vars(StandardOscillator)['render'] is render
+    assert [getattr(cls, kind) for kind, cls in METHODS] == originals
+
+    reset()
+    run(10)
+    assert snapshot() == {}
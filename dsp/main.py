@@ -2,35 +2,54 @@ import numpy as np
 
 from math import floor
 from scipy.io import wavfile
-from wavetable.oscillators import StandardOscillator, ResamplingOscillator, RealTimeResamplingOscillator
+from wavetable.oscillators import StandardOscillator, ResamplingOscillator, RealTimeResamplingOscillator, UnisonOscillator
 from wavetable.utils import normalize, trim
-from wavetable.wavetable import WaveType
+from wavetable.wavetable import DTYPE, WaveType
+
+# The sample rate to render at; the oscillators default to 44.1kHz.
+fs = 44100
 
 # Render a single sawtooth waveform generated by the StandardOscillator.
-s = np.zeros(44100 * 4, dtype='d')
-StandardOscillator(WaveType.SAWTOOTH, 43.65, 0.0, 1.0).render(s)
-wavfile.write('../sounds/single.wav', 44100, s)
+s = np.zeros(fs * 4, dtype=DTYPE)
+StandardOscillator(WaveType.SAWTOOTH, 43.65, 0.0, 1.0,
+    sample_rate=fs).render(s)
+wavfile.write('../sounds/single.wav', fs, s)
 
 # Render a detuned pair generated by StandardOscillator.
-sdp = np.zeros(44100 * 4, dtype='d')
-StandardOscillator(WaveType.SAWTOOTH, 43.65, 0.0, 0.5).render(sdp)
-StandardOscillator(WaveType.SAWTOOTH, 43.65, 3.0, 0.5).render(sdp)
-wavfile.write('../sounds/standard_detuned_pair.wav', 44100, sdp)
+sdp = np.zeros(fs * 4, dtype=DTYPE)
+StandardOscillator(WaveType.SAWTOOTH, 43.65, 0.0, 0.5,
+    sample_rate=fs).render(sdp)
+StandardOscillator(WaveType.SAWTOOTH, 43.65, 3.0, 0.5,
+    sample_rate=fs).render(sdp)
+wavfile.write('../sounds/standard_detuned_pair.wav', fs, sdp)
 
 # Now a detuned pair using the ResamplingOscillator.
-rdp = np.zeros(44100 * 4, dtype='d')
-StandardOscillator(WaveType.SAWTOOTH, 43.65, 0.0, 0.5).render(rdp)
-ResamplingOscillator(WaveType.SAWTOOTH, 43.65, 3.0, 0.5).render(rdp)
-wavfile.write('../sounds/resampling_detuned_pair.wav', 44100, rdp)
+rdp = np.zeros(fs * 4, dtype=DTYPE)
+StandardOscillator(WaveType.SAWTOOTH, 43.65, 0.0, 0.5,
+    sample_rate=fs).render(rdp)
+ResamplingOscillator(WaveType.SAWTOOTH, 43.65, 3.0, 0.5,
+    sample_rate=fs).render(rdp)
+wavfile.write('../sounds/resampling_detuned_pair.wav', fs, rdp)
 
 # Next, to isolate the phase artifacts introduced by using the resampling
 # approach, we'll render the difference between the two previous approaches.
-wavfile.write('../sounds/standard_resampling_diff.wav', 44100,
+wavfile.write('../sounds/standard_resampling_diff.wav', fs,
     normalize(trim(rdp - sdp, pow(2, 3 / 1200.0))))
 
 # And to show that the RealTimeResamplingOscillator produces the same sound
 # as the classic ResamplingOscillator, we'll render another detuned pair here.
-rtdp = np.zeros(44100 * 4, dtype='d')
-StandardOscillator(WaveType.SAWTOOTH, 43.65, 0.0, 0.5).render(rtdp)
-RealTimeResamplingOscillator(WaveType.SAWTOOTH, 43.65, 3.0, 0.5).render(rtdp)
-wavfile.write('../sounds/realtime_detuned_pair.wav', 44100, rtdp)
+rtdp = np.zeros(fs * 4, dtype=DTYPE)
+StandardOscillator(WaveType.SAWTOOTH, 43.65, 0.0, 0.5,
+    sample_rate=fs).render(rtdp)
+RealTimeResamplingOscillator(WaveType.SAWTOOTH, 43.65, 3.0, 0.5,
+    sample_rate=fs).render(rtdp)
+wavfile.write('../sounds/realtime_detuned_pair.wav', fs, rtdp)
+
+# Finally, a seven voice supersaw rendered by a single UnisonOscillator, using
+# the resampling approach to detune each voice.
+detunes = np.linspace(-12.0, 12.0, 7)
+levels = np.full(7, 1.0 / 7)
+ss = np.zeros(fs * 4, dtype=DTYPE)
+UnisonOscillator(WaveType.SAWTOOTH, 43.65, detunes, levels, resampling=True,
+    sample_rate=fs).render(ss)
+wavfile.write('../sounds/resampling_supersaw.wav', fs, ss)
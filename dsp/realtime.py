@@ -0,0 +1,172 @@
+"""
+Module for simulating a real-time audio callback, to test the latency and
+jitter of a processing chain without a sound card.
+
+An audio driver asks for one block of a fixed size at a time, on a fixed
+schedule: one block every block_size / sample_rate seconds. Each callback must
+have its block ready by the time the driver needs it, and one that isn't is an
+xrun, heard as a click or dropout. Here the chain is a graph (see graph.py)
+built by a factory function, and the harness
+
+    1. compiles the graph for the block size, as a host would before starting
+       its stream,
+    2. calls `Graph.process` once per period for the length of the run,
+       sleeping until the driver would request each block (unless `paced` is
+       off, when the callbacks run back to back), and times each call,
+    3. counts an xrun for every callback finishing after its deadline, the end
+       of the period it was requested in, and
+    4. renders the same length offline, from a fresh chain, in a single block,
+       and checks that the stream matches it.
+
+The last step catches any state that doesn't carry across blocks correctly,
+which would only show up as glitches at block boundaries.
+"""
+
+import numpy as np
+import time
+import timeit
+
+from graph import Graph
+from math import ceil
+from wavetable.wavetable import DTYPE, SAMPLE_RATE
+
+# The block sizes swept by default, from the smallest a driver typically
+# offers up to the largest.
+BLOCK_SIZES = (32, 64, 128, 256, 512, 1024, 2048)
+
+def render(factory, size, dtype=DTYPE):
+    """
+    Render `size` samples from a fresh chain in a single block.
+
+    Parameters
+    factory : Function returning the output node of a new chain.
+    size : The number of samples to render.
+    dtype : The dtype of the graph.
+    """
+    graph = Graph(factory(), dtype)
+    graph.compile(size)
+
+    out = np.zeros(size, dtype=dtype)
+    graph.process(out)
+    return out
+
+def run(factory, block_size=64, sample_rate=SAMPLE_RATE, duration=1.0,
+        paced=True, dtype=DTYPE, tolerance=1e-9):
+    """
+    Stream a chain through the simulated callback, returning a report of the
+    run as a dict of
+
+        block_size, sample_rate, period     the callback settings, the period
+                                            in seconds
+        callbacks                           the number of callbacks made
+        mean, p50, p99, max                 callback wall times, in seconds
+        xruns                               the number of callbacks finishing
+                                            after their deadline
+        error                               the largest difference between the
+                                            stream and the offline render
+        matches                             whether that is within tolerance
+
+    Parameters
+    factory : Function returning the output node of a new chain. It is called
+              once for the stream and once for the offline render, so the two
+              chains must start from the same state.
+    block_size : The number of samples per callback.
+    sample_rate : The sample rate, which sets the period of the callbacks.
+    duration : The length of the stream, in seconds.
+    paced : Whether to wait for each callback's period to come around, as a
+            driver would, rather than making the callbacks back to back.
+    dtype : The dtype of the graph.
+    tolerance : The largest difference from the offline render allowed.
+    """
+    callbacks = int(ceil(duration * sample_rate / block_size))
+    size = callbacks * block_size
+    period = block_size / float(sample_rate)
+
+    graph = Graph(factory(), dtype)
+    graph.compile(block_size)
+
+    # Everything the loop touches is set up front, as the driver's buffers
+    # would be, so the loop itself only processes and times.
+    stream = np.zeros(size, dtype=dtype)
+    blocks = [stream[i:i + block_size] for i in range(0, size, block_size)]
+    times = np.zeros(callbacks)
+    xruns = 0
+
+    timer = timeit.default_timer
+    start = timer()
+
+    for k, block in enumerate(blocks):
+        if paced:
+            wait = start + k * period - timer()
+            if wait > 0:
+                time.sleep(wait)
+
+        t = timer()
+        graph.process(block)
+        done = timer()
+
+        times[k] = done - t
+        deadline = start + (k + 1) * period if paced else t + period
+        if done > deadline:
+            xruns += 1
+
+    offline = render(factory, size, dtype)
+    error = float(np.abs(stream - offline).max())
+
+    return {
+        'block_size': block_size,
+        'sample_rate': sample_rate,
+        'period': period,
+        'callbacks': callbacks,
+        'mean': float(times.mean()),
+        'p50': float(np.percentile(times, 50)),
+        'p99': float(np.percentile(times, 99)),
+        'max': float(times.max()),
+        'xruns': xruns,
+        'error': error,
+        'matches': error <= tolerance,
+    }
+
+def sweep(factory, block_sizes=BLOCK_SIZES, **kwargs):
+    """
+    Run the harness at each of the given block sizes, returning the list of
+    reports. The keyword arguments are those of `run`.
+    """
+    return [run(factory, block_size, **kwargs) for block_size in block_sizes]
+
+def summary(report):
+    """
+    Returns a one line summary of a report from `run`.
+    """
+    return ('%5d samples (%6.2fms): p50 %6.3fms, p99 %6.3fms, max %6.3fms, '
+            '%d xruns in %d callbacks, error %.2g%s') % (report['block_size'],
+            report['period'] * 1e3, report['p50'] * 1e3,
+            report['p99'] * 1e3, report['max'] * 1e3, report['xruns'],
+            report['callbacks'], report['error'],
+            '' if report['matches'] else ' MISMATCH')
+
+if __name__ == '__main__':
+    from filters.biquad import AllpassFilter
+    from filters.phaser import Phaser
+    from graph import FilterNode, OscillatorNode
+    from wavetable.oscillators import UnisonOscillator
+    from wavetable.wavetable import WaveType
+
+    # A reese: a detuned unison sawtooth, through an allpass and a phaser.
+    def reese():
+        osc = UnisonOscillator(WaveType.SAWTOOTH, 43.65, [-7.0, 0.0, 7.0],
+                [0.3, 0.4, 0.3], resampling=True)
+        node = OscillatorNode(osc)
+        node = FilterNode(AllpassFilter(SAMPLE_RATE, 1000.0, 0.7), node)
+        return FilterNode(Phaser(6, 0.3), node)
+
+    # Back to back, every block size streams exactly what the chain renders
+    # offline.
+    for report in sweep(reese, duration=0.5, paced=False):
+        print(summary(report))
+        assert report['matches']
+
+    # Then paced, as a driver would call it, at 64 samples.
+    report = run(reese, 64, duration=1.0)
+    print(summary(report))
+    assert report['matches']
@@ -0,0 +1,235 @@
+"""
+Module defining a compact file format for a bank of band-limited wavetables,
+commonly referred to as a mipmap.
+
+Rather than storing one table per MIDI note for every wave type, the note range
+is split into a configurable number of tables per octave, each band-limited for
+the highest note in its range, and only the distinct tables are stored. Tables
+are identified by their wave type and effective partial count (see
+`wavetable.num_partials`), so the 128 identical sine tables collapse to one,
+as do the high note tables whose partial counts collapse to just a few.
+
+Optionally, the tables for higher ranges can also be made smaller, since they
+carry fewer partials (see `wavetable.mipmap_size`), which shrinks the file
+further and keeps the upper tables cache-friendly.
+
+A small header maps each (wave type, MIDI note) pair to its table. The layout
+of the file is as follows, with all values little-endian:
+
+    size (bytes)    field
+    4               magic, 'WTMM'
+    2               format version
+    2               number of wave types, T
+    2               number of MIDI notes, M
+    2               tables per octave
+    4               number of distinct tables, N
+    4               offset of the sample data from the start of the file, bytes
+    8               sample rate the tables were band-limited for (double)
+    2 * T * M       index: the table number of each (wave type, note), row-major
+    8 * N           directory: the (offset, size) of each table, in samples from
+                    the start of the sample data
+    ...             zero padding up to a 64 byte boundary
+    4 * sum(sizes)  sample data, as 32-bit signed integers
+
+The sample data starts on a 64 byte boundary and table sizes are powers of two
+of at least 16 samples, so every table starts on a cache line, which keeps the
+file cache-friendly when embedded in a binary (e.g. with `xxd -i`).
+"""
+
+import numpy as np
+import struct
+import wavetable
+
+from math import ceil
+from utils import freq_to_note, note_to_freq
+
+MAGIC = b'WTMM'
+VERSION = 1
+
+NUM_NOTES = 128
+NUM_TYPES = 4
+
+HEADER = struct.Struct('<4sHHHHIId')
+ALIGNMENT = 64
+
+def top_note(note, tables_per_octave):
+    """
+    Returns the highest MIDI note sharing a table with the given note, when
+    the note range is split into `tables_per_octave` tables per octave. Each
+    table is band-limited for this note, so that no note in its range aliases.
+    """
+    r = (note * tables_per_octave) // 12
+    top = int(ceil((r + 1) * 12.0 / tables_per_octave)) - 1
+    return min(top, NUM_NOTES - 1)
+
+def plan(tables_per_octave=3, sample_rate=wavetable.SAMPLE_RATE,
+        table_size=wavetable.TABLE_SIZE, min_table_size=None):
+    """
+    Returns the index and the list of distinct tables for a mipmap with the
+    given spacing.
+
+    The index is a (NUM_TYPES, NUM_NOTES) array of table numbers, and each
+    table is described by a (wavetype, fq, table_size) tuple suitable for
+    `wavetable.build`.
+
+    Parameters
+    tables_per_octave : The number of tables spanning each octave, from 1 up to
+                        12 (one table per note).
+    sample_rate : The sample rate the tables will be played back at.
+    table_size : The size of the tables, or of the largest table if
+                 `min_table_size` is given.
+    min_table_size : If given, each table is shrunk to the size chosen by
+                     `wavetable.mipmap_size`, down to this size.
+    """
+    if not 1 <= tables_per_octave <= 12:
+        raise Exception('Tables per octave must be between 1 and 12.')
+    if min_table_size is not None and min_table_size < 16:
+        raise Exception('Tables must hold at least 16 samples.')
+
+    index = np.zeros((NUM_TYPES, NUM_NOTES), dtype='<u2')
+    tables = []
+    numbers = {}
+
+    for i in range(NUM_TYPES):
+        for j in range(NUM_NOTES):
+            fq = note_to_freq(top_note(j, tables_per_octave))
+            partials = wavetable.num_partials(i, fq, sample_rate, table_size)
+
+            size = table_size
+            if min_table_size is not None:
+                size = wavetable.mipmap_size(partials, table_size,
+                        min_table_size)
+
+            key = (i, partials, size)
+            if key not in numbers:
+                numbers[key] = len(tables)
+                tables.append((i, fq, size))
+
+            index[i, j] = numbers[key]
+
+    return index, tables
+
+def write(name, tables_per_octave=3, sample_rate=wavetable.SAMPLE_RATE,
+        table_size=wavetable.TABLE_SIZE, min_table_size=None):
+    """
+    Build the distinct band-limited tables for a mipmap with the given spacing
+    and write them, with the header described above, to disk.
+
+    Parameters
+    name : Output file name
+    tables_per_octave : The number of tables spanning each octave.
+    sample_rate : The sample rate the tables will be played back at.
+    table_size : The size of the tables, or of the largest table.
+    min_table_size : If given, the size of the smallest table; see `plan`.
+    """
+    index, tables = plan(tables_per_octave, sample_rate, table_size,
+            min_table_size)
+    data = [wavetable.build(wavetype, fq, sample_rate, size)
+            for wavetype, fq, size in tables]
+
+    directory = np.zeros((len(data), 2), dtype='<u4')
+    offset = 0
+    for i, table in enumerate(data):
+        directory[i] = (offset, table.size)
+        offset += table.size
+
+    header_size = HEADER.size + index.nbytes + directory.nbytes
+    data_offset = -(-header_size // ALIGNMENT) * ALIGNMENT
+
+    header = HEADER.pack(MAGIC, VERSION, NUM_TYPES, NUM_NOTES,
+            tables_per_octave, len(data), data_offset, sample_rate)
+
+    factor = 2**31 - 1
+    with open(name, 'wb') as f:
+        f.write(header)
+        f.write(index.tobytes())
+        f.write(directory.tobytes())
+        f.write(b'\0' * (data_offset - header_size))
+
+        # Round to the nearest step and clip to full scale, as
+        # utils.PcmWriter does, rather than truncating toward zero.
+        for table in data:
+            scaled = np.rint(table * factor)
+            np.clip(scaled, -factor, factor, out=scaled)
+            f.write(scaled.astype('<i4').tobytes())
+
+class MipmapBank(object):
+    """
+    A bank of band-limited wavetables read from a mipmap file written by
+    `write`, for handing to the oscillators in place of `wavetable.build`.
+
+    The file is opened with `np.memmap`, so nothing is read until a table is
+    first requested, and the raw samples are shared between processes through
+    the page cache. Each table is converted to floating point the first time
+    it is requested, in the given dtype, and the converted table is kept for
+    later requests.
+
+    The tables are band-limited for the sample rate recorded in the file, and
+    may vary in size from range to range.
+
+    Parameters
+    name : Mipmap file name
+    dtype : The dtype of the tables handed out.
+    """
+
+    def __init__(self, name, dtype=wavetable.DTYPE):
+        with open(name, 'rb') as f:
+            fields = HEADER.unpack(f.read(HEADER.size))
+
+        magic, version, num_types, num_notes, tables_per_octave, num_tables, \
+                data_offset, sample_rate = fields
+
+        if magic != MAGIC or version != VERSION:
+            raise Exception('Unrecognized mipmap file.')
+
+        self.tables_per_octave = tables_per_octave
+        self.sample_rate = sample_rate
+        self.num_notes = num_notes
+        self.dtype = np.dtype(dtype)
+
+        index_offset = HEADER.size
+        directory_offset = index_offset + 2 * num_types * num_notes
+
+        self._index = np.memmap(name, dtype='<u2', mode='r',
+                offset=index_offset, shape=(num_types, num_notes))
+        self._directory = np.memmap(name, dtype='<u4', mode='r',
+                offset=directory_offset, shape=(num_tables, 2))
+        self._data = np.memmap(name, dtype='<i4', mode='r', offset=data_offset)
+
+        self._tables = {}
+
+    def __len__(self):
+        return self._directory.shape[0]
+
+    def note(self, fq):
+        """
+        Returns the MIDI note whose table should be used for the given
+        frequency: the nearest note at or above it, so that the table is
+        band-limited for at least that frequency.
+        """
+        note = int(ceil(freq_to_note(fq) - 1e-6))
+        return min(max(note, 0), self.num_notes - 1)
+
+    def table(self, wavetype, fq):
+        """
+        Returns the band-limited wavetable for the given wave type and
+        frequency as a read-only array.
+
+        Parameters
+        wavetype : WaveType specifying the type of table.
+        fq : Frequency the table will be played back at.
+        """
+        number = int(self._index[wavetype, self.note(fq)])
+
+        table = self._tables.get(number)
+        if table is None:
+            offset, size = self._directory[number]
+            samples = self._data[offset:offset + size]
+
+            table = np.asarray(samples).astype('d')
+            table /= 2**31 - 1
+            table = table.astype(self.dtype, copy=False)
+            table.flags.writeable = False
+            self._tables[number] = table
+
+        return table
@@ -3,9 +3,10 @@ Module for utility functions on Numpy arrays.
 """
 
 import numpy as np
+import struct
+import tempfile
 
-from math import floor
-from scipy.io import wavfile
+from math import floor, log
 
 def normalize(arr):
     """
@@ -31,28 +32,375 @@ def note_to_freq(note):
     """
     return 440.0 * pow(2.0, (note - 69) / 12.0)
 
-def write_wav(name, sr, arr):
+def freq_to_note(freq):
     """
-    Write a numpy array to disk as a little-endian 32-bit signed WAV file.
+    Return the (fractional) MIDI note value for a given frequency.
+    """
+    return 69 + 12 * log(freq / 440.0, 2)
+
+def _blocks(arr, block_size):
+    """
+    Yields successive blocks of `block_size` samples along the last axis.
+    """
+    for i in range(0, arr.shape[-1], block_size):
+        yield arr[..., i:i + block_size]
+
+def write_wav(name, sr, arr, sample_format='int32', block_size=65536):
+    """
+    Write a numpy array to disk as a little-endian WAV file, 32-bit signed by
+    default. The array is converted a block at a time, so no full-size copy of
+    it is made.
+
+    As with `scipy.io.wavfile.write`, a 2D array is read as (samples x
+    channels). The streaming writers below take (channels x samples) blocks
+    instead, like the blocks processed everywhere else in this package.
 
     Parameters
     name : Output file name
     sr : Output sample rate
-    arr : The numpy array to write
+    arr : The numpy array to write; 1D, or (samples x channels)
+    sample_format : One of the formats in `SAMPLE_FORMATS`
+    block_size : The number of samples converted at a time
     """
-    factor = 2**31 - 1
-    output = (arr * factor).astype('<i4')
-    wavfile.write(name, sr, output)
+    stream_wav(name, sr, _blocks(arr.T, block_size), channels=_channels(arr),
+            sample_format=sample_format)
 
-def write_pcm(name, arr):
+def write_pcm(name, arr, sample_format='int32', block_size=65536):
     """
     Write a numpy array to disk as a PCM file. Virtually the same as `write_wav`
-    above, but the resulting file doesn't have the WAV header.
+    above, but the resulting file doesn't have the WAV header. A 2D array is
+    likewise read as (samples x channels).
 
     Parameters
     name : Output file name
-    arr : The numpy array to write
+    arr : The numpy array to write; 1D, or (samples x channels)
+    sample_format : One of the formats in `SAMPLE_FORMATS`
+    block_size : The number of samples converted at a time
+    """
+    stream_pcm(name, _blocks(arr.T, block_size), channels=_channels(arr),
+            sample_format=sample_format)
+
+def stream_wav(name, sr, blocks, **kwargs):
+    """
+    Write each block produced by `blocks`, e.g. a generator rendering an
+    oscillator block by block, to a WAV file. The keyword arguments are those
+    of `WavWriter`.
+    """
+    with WavWriter(name, sr, **kwargs) as writer:
+        for block in blocks:
+            writer.write(block)
+
+def stream_pcm(name, blocks, **kwargs):
+    """
+    Write each block produced by `blocks` to a PCM file. The keyword arguments
+    are those of `PcmWriter`.
+    """
+    with PcmWriter(name, **kwargs) as writer:
+        for block in blocks:
+            writer.write(block)
+
+def _channels(arr):
+    return 1 if arr.ndim == 1 else arr.shape[1]
+
+# The output sample formats, mapping each name to its WAV format tag, sample
+# width in bytes, and the value full scale is mapped to.
+SAMPLE_FORMATS = {
+    'int16': (1, 2, 2**15 - 1),
+    'int24': (1, 3, 2**23 - 1),
+    'int32': (1, 4, 2**31 - 1),
+    'float32': (3, 4, 1.0),
+}
+
+class PcmWriter(object):
     """
-    factor = 2**31 - 1
-    output = (arr * factor).astype('<i4')
-    output.tofile(name)
+    Writes a stream of blocks to disk as interleaved little-endian PCM,
+    converting each block to the output format as it arrives, so memory use
+    stays at the size of a block however long the stream runs.
+
+    Integer output is rounded to the nearest step and clipped to full scale,
+    optionally with TPDF dither: triangular noise of +/- 1 step added before
+    rounding, which decorrelates the quantization error from the signal.
+
+    With `normalize` set, nothing can be written until the peak of the whole
+    stream is known, so the blocks are first spooled to a temporary file. On
+    close, the file is memory mapped and written out block by block, scaled
+    into the range [-1, 1] as `normalize` does.
+
+    Parameters
+    name : Output file name
+    sample_format : One of the formats in `SAMPLE_FORMATS`; 'int32' by default
+    channels : The number of channels; each block is 1D for a single
+               channel, or (channels x samples)
+    dither : Whether to dither integer output
+    normalize : Whether to normalize the stream by its peak
+    seed : Optional seed for the dither noise
+    """
+
+    def __init__(self, name, sample_format='int32', channels=1, dither=False,
+            normalize=False, seed=None):
+        if sample_format not in SAMPLE_FORMATS:
+            raise Exception('Unknown sample format: %s.' % sample_format)
+
+        self.sample_format = sample_format
+        self.channels = channels
+        self.dither = dither
+        self.normalize = normalize
+        self.frames = 0
+
+        self._tag, self._width, self._factor = SAMPLE_FORMATS[sample_format]
+        self._random = np.random.RandomState(seed)
+        self._scratch = Scratch()
+
+        # The peak of the stream and the largest block, for the second pass.
+        self._peak = 0.0
+        self._block = 0
+        self._spool = tempfile.TemporaryFile() if normalize else None
+
+        self._file = open(name, 'wb')
+        self._file.write(self._header())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _header(self):
+        return b''
+
+    def _finish(self):
+        pass
+
+    def write(self, block):
+        """
+        Convert the given block and append it to the file.
+        """
+        frames = np.reshape(block, (self.channels, -1)).T
+        n = frames.shape[0]
+
+        if self._spool is None:
+            self._convert(frames, 1.0)
+        else:
+            spooled = self._scratch.get('spooled', frames.shape)
+            np.abs(frames, out=spooled)
+            if n:
+                self._peak = max(self._peak, float(spooled.max()))
+            np.copyto(spooled, frames)
+            spooled.tofile(self._spool)
+            self._block = max(self._block, n)
+
+        self.frames += n
+
+    def _convert(self, frames, gain):
+        """
+        Write the (samples x channels) `frames`, scaled by `gain`, in the
+        output format.
+        """
+        if self._tag == 3:
+            out = self._scratch.get('out', frames.shape, np.dtype('<f4'))
+            np.multiply(frames, gain, out=out)
+            out.tofile(self._file)
+            return
+
+        scaled = self._scratch.get('scaled', frames.shape)
+        np.multiply(frames, gain * self._factor, out=scaled)
+        if self.dither:
+            scaled += self._random.triangular(-1.0, 0.0, 1.0, scaled.shape)
+        np.rint(scaled, out=scaled)
+        np.clip(scaled, -self._factor, self._factor, out=scaled)
+
+        if self._width == 2:
+            out = self._scratch.get('out', frames.shape, np.dtype('<i2'))
+            np.copyto(out, scaled, casting='unsafe')
+        else:
+            out = self._scratch.get('out', frames.shape, np.dtype('<i4'))
+            np.copyto(out, scaled, casting='unsafe')
+
+            if self._width == 3:
+                # Keep the low three bytes of each little-endian sample.
+                wide = out.reshape(-1).view(np.uint8).reshape(-1, 4)
+                out = self._scratch.get('packed', (wide.shape[0], 3),
+                        np.uint8)
+                np.copyto(out, wide[:, :3])
+
+        out.tofile(self._file)
+
+    def close(self):
+        """
+        Write out the spooled stream if normalizing, finish the file and close
+        it.
+        """
+        if self._file.closed:
+            return
+
+        if self._spool is not None:
+            self._spool.flush()
+
+            if self.frames:
+                spooled = np.memmap(self._spool, dtype='d', mode='r',
+                        shape=(self.frames, self.channels))
+                gain = 1.0 / self._peak if self._peak else 1.0
+
+                for i in range(0, self.frames, self._block):
+                    self._convert(spooled[i:i + self._block], gain)
+
+                del spooled
+
+            self._spool.close()
+
+        self._finish()
+        self._file.close()
+
+class WavWriter(PcmWriter):
+    """
+    A `PcmWriter` for WAV files. The header is written up front with empty
+    sizes, which are filled in on close.
+
+    Parameters
+    name : Output file name
+    sr : Output sample rate
+
+    The rest are as in `PcmWriter`.
+    """
+
+    def __init__(self, name, sr, **kwargs):
+        self.sr = int(sr)
+        PcmWriter.__init__(self, name, **kwargs)
+
+    def _header(self):
+        align = self.channels * self._width
+        fmt = struct.pack('<HHIIHH', self._tag, self.channels, self.sr,
+                self.sr * align, align, 8 * self._width)
+
+        # Formats other than integer PCM carry the size of the (empty) format
+        # extension, and a fact chunk holding the number of frames.
+        fact = b''
+        if self._tag != 1:
+            fmt += struct.pack('<H', 0)
+            fact = struct.pack('<4sII', b'fact', 4, 0)
+
+        return struct.pack('<4sI4s4sI', b'RIFF', 0, b'WAVE', b'fmt ',
+                len(fmt)) + fmt + fact + struct.pack('<4sI', b'data', 0)
+
+    def _finish(self):
+        size = self.frames * self.channels * self._width
+        header = len(self._header())
+
+        # Chunks are padded to an even number of bytes.
+        if size % 2:
+            self._file.write(b'\0')
+
+        self._file.seek(4)
+        self._file.write(struct.pack('<I', header - 8 + size + size % 2))
+        self._file.seek(header - 4)
+        self._file.write(struct.pack('<I', size))
+
+        if self._tag != 1:
+            # The fact chunk sits just before the data chunk.
+            self._file.seek(header - 12)
+            self._file.write(struct.pack('<I', self.frames))
+
+class Scratch(object):
+    """
+    A set of named scratch arrays, reused from one block to the next by the
+    oscillators and filters. An array is only reallocated when a larger block
+    (or a different dtype) is requested, so processing a stream of blocks no
+    larger than the first allocates no new arrays.
+    """
+
+    def __init__(self):
+        self._arrays = {}
+
+    def get(self, name, shape, dtype=np.float64):
+        """
+        Returns the scratch array with the given name, viewed with the given
+        shape. Its contents are undefined.
+        """
+        if not isinstance(shape, tuple):
+            shape = (shape,)
+
+        size = 1
+        for n in shape:
+            size *= n
+
+        arr = self._arrays.get(name)
+        if arr is None or arr.size < size or arr.dtype != dtype:
+            arr = self._arrays[name] = np.empty(size, dtype=dtype)
+
+        return arr[:size].reshape(shape)
+
+    def ramp(self, n):
+        """
+        Returns the sequence 0, 1, ..., n - 1 as floating point values.
+        """
+        arr = self._arrays.get('ramp')
+        if arr is None or arr.size < n:
+            arr = self._arrays['ramp'] = np.arange(n, dtype=np.float64)
+
+        return arr[:n]
+
+if __name__ == '__main__':
+    import os
+
+    from scipy.io import wavfile
+
+    name = os.path.join(tempfile.gettempdir(), 'utils_test.wav')
+    t = np.arange(44100 * 2 + 1) / 44100.0
+    x = 0.5 * np.vstack([np.sin(2 * np.pi * 440.0 * t),
+                         np.sin(2 * np.pi * 660.0 * t)])
+
+    # Each format reads back as the input, up to its quantization step (and
+    # one step more with dither). Odd frame counts exercise the padding of the
+    # 24-bit data chunk.
+    for sample_format, (tag, width, factor) in SAMPLE_FORMATS.items():
+        for dither in (False, True):
+            stream_wav(name, 44100, _blocks(x, 1000), channels=2,
+                    sample_format=sample_format, dither=dither, seed=0)
+            header = 44 if tag == 1 else 58
+            assert os.path.getsize(name) == \
+                    header + (x.size * width + 1) // 2 * 2
+
+            if width == 3:
+                # scipy can't read 24-bit files, so unpack the data by hand.
+                raw = np.fromfile(name, dtype=np.uint8)[44:44 + x.size * 3]
+                y = np.zeros((x.size, 4), dtype=np.uint8)
+                y[:, 1:] = raw.reshape(-1, 3)
+                y = y.view('<i4').reshape(-1, 2) >> 8
+            else:
+                sr, y = wavfile.read(name)
+                assert sr == 44100
+
+            step = 2.0 if dither else 0.5
+            assert np.abs(y.T / float(factor) - x).max() <= step / factor + 1e-7
+
+    # The array helpers take (samples x channels), as scipy does, and write
+    # the same interleaved samples as streaming the transposed blocks.
+    write_wav(name, 44100, x.T)
+    sr, y = wavfile.read(name)
+    assert sr == 44100 and y.shape == x.T.shape
+    assert np.abs(y / float(2**31 - 1) - x.T).max() <= 0.5 / (2**31 - 1)
+
+    write_pcm(name, x.T, sample_format='int16')
+    y = np.fromfile(name, dtype='<i2').reshape(-1, 2)
+    assert np.array_equal(y, np.rint(x.T * (2**15 - 1)))
+
+    # Mono, normalized in two passes through the spool.
+    with WavWriter(name, 44100, sample_format='float32',
+            normalize=True) as writer:
+        for block in _blocks(x[0], 512):
+            writer.write(block)
+
+    sr, y = wavfile.read(name)
+    assert y.dtype == np.float32 and y.size == x.shape[1]
+    assert np.allclose(y, normalize(x[0].copy()), atol=1e-7)
+
+    # Floating point files have the 18 byte fmt chunk, with an empty
+    # extension, and a fact chunk holding the number of frames.
+    with open(name, 'rb') as f:
+        header = f.read(58)
+    assert header[12:16] == b'fmt ' and header[16:20] == struct.pack('<I', 18)
+    assert header[36:38] == struct.pack('<H', 0)
+    assert header[38:50] == struct.pack('<4sII', b'fact', 4, x.shape[1])
+    assert header[50:54] == b'data'
+
+    os.remove(name)
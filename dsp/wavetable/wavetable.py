@@ -4,20 +4,30 @@ wavetables.
 
 Construction is done with additive synthesis, including partials just up to
 Nyquist so as to avoid aliasing, with no accommodation for the Gibbs Phenomenon.
+Rather than summing a full-length sine for every partial, the partials are
+written into a harmonic spectrum and the table is computed with a single inverse
+real FFT, so building a table costs O(N log N) regardless of the partial count.
 
-Note that the table size and the sample rate in this implementation are fixed,
-where in practice they should likely be configurable. In particular, it's often
-a good idea to reduce the size of the wavetable for the higher frequency tables,
-because in a larger table the iterator (when rendering from the table) ends up
-really big. Each read, then, could essentially be considered a random access.
-Depending on the host's paging and caching architecture, this can be a large
-performance hit.
+The table size and the sample rate default to TABLE_SIZE and SAMPLE_RATE, but
+both can be given per table. In particular, it's often a good idea to reduce
+the size of the wavetable for the higher frequency tables, because in a larger
+table the iterator (when rendering from the table) ends up really big. Each
+read, then, could essentially be considered a random access. Depending on the
+host's paging and caching architecture, this can be a large performance hit.
+See `mipmap_size` for choosing a smaller table for a given partial count.
+
+Tables are synthesized in double precision, then stored in the requested dtype,
+DTYPE by default. Single precision tables take half the memory and cache of
+double precision ones, with errors of around 1e-7, far below the resolution of
+16-bit output.
 """
 
 import matplotlib.pyplot as plt
 import numpy as np
+import threading
 import time
 
+from collections import OrderedDict
 from math import floor
 from utils import normalize, note_to_freq
 
@@ -25,7 +35,20 @@ TABLE_SIZE = 4096
 
 SAMPLE_RATE = 44100.0
 NYQUIST = SAMPLE_RATE / 2.0
-MAX_PARTIALS = TABLE_SIZE / 2
+MAX_PARTIALS = TABLE_SIZE // 2
+
+# The minimum number of table samples per cycle of the highest partial in a
+# table sized by `mipmap_size`, and the smallest such table.
+SAMPLES_PER_PARTIAL = 16
+MIN_TABLE_SIZE = 64
+
+# The default dtype of the tables, and of the buffers and filter state of
+# everything processing them; np.float32 halves their size.
+DTYPE = np.float64
+
+# The maximum number of tables held by the shared table cache. At the default
+# table size this bounds the cache at 16MB.
+CACHE_SIZE = 512
 
 class WaveType:
     """
@@ -36,98 +59,222 @@ class WaveType:
     SAWTOOTH = 2
     SQUARE = 3
 
-def _sine():
+class TableCache(object):
     """
-    Returns a sine wavetable.
+    A bounded cache of read-only wavetables, shared by every oscillator in the
+    process, evicting the least recently used table once full.
+
+    Parameters
+    maxsize : The maximum number of tables held by the cache.
     """
-    t = np.linspace(0, 1, num=TABLE_SIZE, dtype='d')
-    table = np.sin(2 * np.pi * t)
-    return normalize(table)
 
-def _triangle(fq):
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """
+        Returns the table stored under `key`, calling `factory` to construct
+        it on a miss. Tables are marked read-only since they are shared.
+        """
+        with self._lock:
+            table = self._tables.pop(key, None)
+            if table is not None:
+                # Reinsert to mark the table as the most recently used.
+                self._tables[key] = table
+                self.hits += 1
+                return table
+            self.misses += 1
+
+        table = factory()
+        table.flags.writeable = False
+
+        with self._lock:
+            self._tables[key] = table
+            while len(self._tables) > self.maxsize:
+                self._tables.popitem(last=False)
+
+        return table
+
+    def clear(self):
+        """
+        Drop every cached table and reset the hit and miss counters.
+        """
+        with self._lock:
+            self._tables.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._tables)
+
+cache = TableCache()
+
+def num_partials(wavetype, fq, sample_rate=SAMPLE_RATE, table_size=TABLE_SIZE):
     """
-    Returns a band-limited triangle wavetable.
+    Returns the effective number of partials in a table of the given type
+    built for the given frequency; tables with the same count are identical.
+
+    For the triangle and square waves, which carry only odd harmonics, the
+    count is rounded down to the highest odd harmonic. The sine table carries
+    a single partial regardless of frequency.
 
     Parameters
+    wavetype : WaveType specifying the type of table.
     fq : Frequency used to determine the number of bands drawn in the table.
+    sample_rate : The sample rate the table will be played back at.
+    table_size : The size of the table, which bounds the number of partials.
     """
-    num_partials = min(int(floor(NYQUIST / fq)), MAX_PARTIALS)
-
-    t = np.linspace(0, 1, num=TABLE_SIZE, dtype='d')
-    table = np.zeros(TABLE_SIZE, dtype='d')
-    alt = -1.0
+    nyquist = sample_rate / 2.0
+    count = min(int(floor(nyquist / fq)), table_size // 2)
 
-    for j in range(num_partials):
-        k = j + 1
-        if k % 2 == 0:
-            continue
+    if wavetype == WaveType.SINE:
+        return 1
+    elif wavetype == WaveType.SAWTOOTH:
+        return count
+    elif wavetype == WaveType.TRIANGLE or wavetype == WaveType.SQUARE:
+        return max(count - (1 - count % 2), 0)
+    else:
+        raise Exception('Unrecognized WaveType.')
 
-        alt *= -1
-        table -= np.sin(2 * np.pi * k * t) / (alt * k * k * np.pi)
+def mipmap_size(num_partials, table_size=TABLE_SIZE,
+        min_table_size=MIN_TABLE_SIZE):
+    """
+    Returns the smallest power of two table size, between `min_table_size` and
+    `table_size`, that holds at least SAMPLES_PER_PARTIAL samples per cycle of
+    the highest partial. Tables for high notes carry few partials, and so can
+    be much smaller than those for low notes.
+    """
+    size = min_table_size
+    while size < table_size and size < SAMPLES_PER_PARTIAL * num_partials:
+        size *= 2
 
-    return normalize(table)
+    return min(size, table_size)
 
-def _sawtooth(fq):
+def _synthesize(amplitudes, table_size):
     """
-    Returns a band-limited sawtooth wavetable.
+    Returns a wavetable composed of sine partials, where amplitudes[k] is the
+    amplitude of the kth harmonic, computed with a single inverse real FFT.
+
+    The table holds exactly one period sampled at t = j / table_size, so that
+    it wraps seamlessly when read with a mask.
 
     Parameters
-    fq : Frequency used to determine the number of bands drawn in the table.
+    amplitudes : Array of partial amplitudes; amplitudes[0] (DC) is ignored.
+    table_size : The size of the table.
     """
-    num_partials = min(int(floor(NYQUIST / fq)), MAX_PARTIALS)
-
-    t = np.linspace(0, 1, num=TABLE_SIZE, dtype='d')
-    table = np.zeros(TABLE_SIZE, dtype='d')
+    # A sine partial sin(2 * pi * k * t) with amplitude A appears in the
+    # spectrum of an N sample table as -j * A * N / 2 in bin k.
+    spectrum = np.zeros(table_size // 2 + 1, dtype=complex)
+    n = min(amplitudes.size, spectrum.size)
+    spectrum[1:n] = -0.5j * table_size * amplitudes[1:n]
 
-    for j in range(num_partials):
-        k = j + 1
-        table -= np.sin(2 * np.pi * k * t) / (k * np.pi)
+    return np.fft.irfft(spectrum, table_size)
 
-    return normalize(table)
+def _sine(table_size):
+    """
+    Returns a sine wavetable.
+    """
+    amplitudes = np.array([0.0, 1.0])
+    return normalize(_synthesize(amplitudes, table_size))
 
-def _square(fq):
+def _triangle(num_partials, table_size):
     """
-    Returns a band-limited square wavetable.
+    Returns a band-limited triangle wavetable.
 
     Parameters
-    fq : Frequency used to determine the number of bands drawn in the table.
+    num_partials : The number of partials drawn in the table.
+    table_size : The size of the table.
     """
-    num_partials = min(int(floor(NYQUIST / fq)), MAX_PARTIALS)
+    # Odd harmonics only, falling off with 1 / k^2 and alternating in sign.
+    k = np.arange(num_partials + 1, dtype='d')
+    amplitudes = np.zeros(num_partials + 1, dtype='d')
+    odd = k[1::2]
+    alt = np.where(odd % 4 == 1, 1.0, -1.0)
+    amplitudes[1::2] = -1.0 / (alt * odd * odd * np.pi)
 
-    t = np.linspace(0, 1, num=TABLE_SIZE, dtype='d')
-    table = np.zeros(TABLE_SIZE, dtype='d')
+    return normalize(_synthesize(amplitudes, table_size))
 
-    for j in range(num_partials):
-        k = j + 1
-        if k % 2 == 0:
-            continue
+def _sawtooth(num_partials, table_size):
+    """
+    Returns a band-limited sawtooth wavetable.
 
-        table -= np.sin(2 * np.pi * k * t) / (k * np.pi)
+    Parameters
+    num_partials : The number of partials drawn in the table.
+    table_size : The size of the table.
+    """
+    k = np.arange(num_partials + 1, dtype='d')
+    amplitudes = np.zeros(num_partials + 1, dtype='d')
+    amplitudes[1:] = -1.0 / (k[1:] * np.pi)
 
-    return normalize(table)
+    return normalize(_synthesize(amplitudes, table_size))
 
-def build(wavetype, fq):
+def _square(num_partials, table_size):
     """
-    Public API for constructing a band-limited wavetable.
+    Returns a band-limited square wavetable.
 
     Parameters
-    wavetype : WaveType specifying the type of table to be constructed.
-    fq : Frequency used to determine the number of bands drawn in the table.
+    num_partials : The number of partials drawn in the table.
+    table_size : The size of the table.
+    """
+    # Odd harmonics only, falling off with 1 / k.
+    k = np.arange(num_partials + 1, dtype='d')
+    amplitudes = np.zeros(num_partials + 1, dtype='d')
+    amplitudes[1::2] = -1.0 / (k[1::2] * np.pi)
+
+    return normalize(_synthesize(amplitudes, table_size))
+
+def _build(wavetype, num_partials, table_size, dtype=DTYPE):
+    """
+    Constructs a wavetable of the given type, number of partials, size and
+    dtype.
     """
     if wavetype == WaveType.SINE:
-        return _sine()
+        table = _sine(table_size)
     elif wavetype == WaveType.TRIANGLE:
-        return _triangle(fq)
+        table = _triangle(num_partials, table_size)
     elif wavetype == WaveType.SAWTOOTH:
-        return _sawtooth(fq)
+        table = _sawtooth(num_partials, table_size)
     elif wavetype == WaveType.SQUARE:
-        return _square(fq)
+        table = _square(num_partials, table_size)
     else:
         raise Exception('Unrecognized WaveType.')
 
+    return table.astype(dtype, copy=False)
+
+def build(wavetype, fq, sample_rate=SAMPLE_RATE, table_size=TABLE_SIZE,
+        dtype=DTYPE):
+    """
+    Public API for constructing a band-limited wavetable.
+
+    Tables are memoized in the shared `cache`, keyed by wave type, effective
+    partial count, table size and dtype, so every caller asking for the same
+    table receives the same read-only array.
+
+    Parameters
+    wavetype : WaveType specifying the type of table to be constructed.
+    fq : Frequency used to determine the number of bands drawn in the table.
+    sample_rate : The sample rate the table will be played back at.
+    table_size : The size of the table, which must be a power of two.
+    dtype : The dtype of the table.
+    """
+    if table_size & (table_size - 1):
+        raise Exception('Table size must be a power of two.')
+
+    partials = num_partials(wavetype, fq, sample_rate, table_size)
+    dtype = np.dtype(dtype)
+    key = (wavetype, partials, table_size, dtype.char)
+
+    return cache.get(key,
+            lambda: _build(wavetype, partials, table_size, dtype))
+
 if __name__ == '__main__':
     # Show an interactive plot of the band-limited tables.
-    x = np.linspace(0, 1, num=TABLE_SIZE, dtype='d')
+    x = np.arange(TABLE_SIZE, dtype='d') / TABLE_SIZE
 
     plt.ion()
     for i in range(4):